@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime as dt
+import pandas as pd
+from price_store import STALE_AFTER
+
+BACKTEST_CACHE_DIR = "backtest_cache"
+CACHE_META = "histories.json"
+
+
+def bars_digest(bars: pd.DataFrame) -> str:
+    """Hashes the bars, their dates included."""
+    return hashlib.sha256(pd.util.hash_pandas_object(bars).to_numpy().tobytes()).hexdigest()
+
+
+class HistoryCache:
+    """
+    Daily bars and dividends per symbol, one Parquet file each (a pickle without pyarrow), with
+    the fetch time and the earliest start covered in a JSON index next to them. The bars keep
+    their exchange time zone so the backtester sees exactly what the provider returned.
+    """
+
+    def __init__(self, cache_dir: str = BACKTEST_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.meta_path = os.path.join(cache_dir, CACHE_META)
+        try:
+            with open(self.meta_path) as fp:
+                self.meta = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            self.meta = {}
+
+    def read(self, symbol: str):
+        entry = self.meta.get(symbol)
+        if entry is None or not os.path.exists(entry["path"]):
+            return None
+        if entry["path"].endswith(".parquet"):
+            return pd.read_parquet(entry["path"])
+        return pd.read_pickle(entry["path"])
+
+    def write(self, symbol: str, bars: pd.DataFrame, start: str, fetched_at: dt):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        base = os.path.join(self.cache_dir, symbol)
+        try:
+            bars.to_parquet(base + ".parquet")
+            path = base + ".parquet"
+        except ImportError:
+            bars.to_pickle(base + ".pkl")
+            path = base + ".pkl"
+        self.meta[symbol] = {"path": path, "start": start, "fetched_at": fetched_at.isoformat(),
+                             "last_date": bars.index[-1].strftime("%Y-%m-%d") if len(bars) else None,
+                             "digest": bars_digest(bars)}
+
+    def version(self, symbol: str):
+        """
+        A digest of symbol's cached bars, None when it is not cached (or was cached without one). A
+        re-fetch returning the same bars keeps the version, only changed bars change it.
+        """
+        entry = self.meta.get(symbol)
+        return entry.get("digest") if entry is not None else None
+
+    def save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self.meta_path, "w") as fp:
+            json.dump(self.meta, fp, indent=2)
+
+    def fetch_starts(self, symbols, start: str, now: dt) -> dict:
+        """
+        {symbol: date to fetch from} for the symbols that need fetching: from start when the cache
+        lacks them or begins after start, from the last cached bar when that is stale.
+        """
+        starts = {}
+        for symbol in symbols:
+            entry = self.meta.get(symbol)
+            if entry is None or not os.path.exists(entry["path"]) or entry["start"] > start:
+                starts[symbol] = start
+            elif now - dt.fromisoformat(entry["fetched_at"]) > STALE_AFTER:
+                # Re-fetch the last cached bar as well, it may have been a partial day
+                starts[symbol] = entry["last_date"] or start
+        return starts
+
+
+def load_histories(symbols, start: str, offline: bool = False, fetcher=None, cache_dir: str = BACKTEST_CACHE_DIR,
+                   now: dt = None):
+    """
+    Returns ({symbol: bars}, {symbol: error}) for symbols, each loaded once for the whole run.
+
+    Fresh cached histories are used as they are and stale ones only fetch the bars after their
+    last cached day, all symbols in one parallel round. Offline, nothing is fetched and symbols
+    missing from the cache are errors.
+    """
+    from market_data import Fetcher
+
+    now = now or dt.now()
+    cache = HistoryCache(cache_dir)
+    histories, errors = {}, {}
+    starts = {} if offline else cache.fetch_starts(symbols, start, now)
+    if starts:
+        fetcher = fetcher or Fetcher()
+        logging.info("Fetching %s for the backtest", ", ".join(starts))
+        fetched = fetcher.fetch_many(list(starts), starts)
+        errors.update(fetcher.errors)
+        for symbol, bars in fetched.items():
+            cached = cache.read(symbol) if starts[symbol] != start else None
+            if cached is not None:
+                bars = pd.concat([cached, bars])
+                bars = bars[~bars.index.duplicated(keep="last")].sort_index()
+            cache.write(symbol, bars, cache.meta[symbol]["start"] if cached is not None else start, now)
+            histories[symbol] = bars
+        cache.save()
+    for symbol in symbols:
+        if symbol in histories:
+            continue
+        bars = cache.read(symbol)
+        if bars is None:
+            errors.setdefault(symbol, "not in the backtest cache")
+            continue
+        if symbol in errors:
+            logging.warning("Could not refresh %s, backtesting on the cached bars: %s", symbol, errors.pop(symbol))
+        histories[symbol] = bars
+    return histories, errors
@@ -0,0 +1,120 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+from fx_align import FX_COLUMN
+
+# Annual risk free rate the Sharpe ratio is measured against
+RISK_FREE_RATE = 0.0
+DAYS_PER_YEAR = 365.25
+# Bracket for the IRR search, and the iterations and tolerance it stops at
+IRR_BOUNDS = (-0.9999, 100.0)
+IRR_ITERATIONS = 60
+IRR_TOLERANCE = 1e-10
+METRICS = ("cagr", "max_drawdown", "volatility", "sharpe", "irr")
+
+
+def equity_curve(bars: pd.DataFrame, buys: np.ndarray, units: np.ndarray, contribution: float,
+                 dividends: pd.DataFrame, last: int) -> pd.DataFrame:
+    """
+    The position every trading day from the first buy to the bar at last: units held, their value
+    in AUD, the AUD contributed so far and the dividends paid out so far, with Equity the sum of
+    the holding and the paid out dividends. Built with bincounts and running sums, O(days).
+    """
+    first = int(buys[0]) if len(buys) else last
+    days = last + 1
+    bought = np.bincount(buys, weights=units, minlength=days)[:days]
+    contributed = np.bincount(buys, minlength=days)[:days] * contribution
+    events = np.searchsorted(bars["Date"].to_numpy(), dividends["Date"].to_numpy())
+    reinvested = np.bincount(events, weights=dividends["Reinvested Units"].to_numpy(), minlength=days)[:days]
+    paid_out = np.where(dividends["Reinvested Units"].to_numpy() > 0, 0.0,
+                        dividends["Net"].to_numpy() * dividends["AUD Rate"].to_numpy())
+    paid = np.bincount(events, weights=paid_out, minlength=days)[:days]
+
+    units_held = np.cumsum(bought + reinvested)[first:]
+    close = bars["Close"].to_numpy(dtype=float)[first:days]
+    rate = bars[FX_COLUMN].to_numpy(dtype=float)[first:days]
+    value = units_held * close * rate
+    paid = np.cumsum(paid)[first:]
+    return pd.DataFrame({"Date": bars["Date"].to_numpy()[first:days], "Units": units_held, "Price": close,
+                         FX_COLUMN: rate, "Value": value, "Contributions": np.cumsum(contributed)[first:],
+                         "Dividends": paid, "Equity": value + paid})
+
+
+def irr(amounts: np.ndarray, years: np.ndarray) -> float:
+    """
+    The annual rate that discounts cash flows amounts, paid years after the first, to a net present
+    value of zero. Newton steps on log(1 + rate), falling back to bisecting the bracket whenever a
+    step leaves it, each step one O(n) pass. NaN when the bracket holds no root.
+    """
+    def npv(log_growth):
+        discounted = amounts * np.exp(-years * log_growth)
+        return discounted.sum(), -(discounted * years).sum()
+
+    low, high = np.log1p(IRR_BOUNDS[0]), np.log1p(IRR_BOUNDS[1])
+    npv_low, npv_high = npv(low)[0], npv(high)[0]
+    if not len(amounts) or np.isnan(npv_low) or np.sign(npv_low) == np.sign(npv_high):
+        return np.nan
+    guess = 0.0 if low < 0.0 < high else (low + high) / 2
+    for _ in range(IRR_ITERATIONS):
+        value, slope = npv(guess)
+        if np.sign(value) == np.sign(npv_low):
+            low = guess
+        else:
+            high = guess
+        step = guess - value / slope if slope else np.nan
+        if not low < step < high:
+            step = (low + high) / 2
+        if abs(step - guess) < IRR_TOLERANCE:
+            return float(np.expm1(step))
+        guess = step
+    return float(np.expm1(guess))
+
+
+def risk_metrics(curve: pd.DataFrame, risk_free: float = RISK_FREE_RATE) -> dict:
+    """
+    CAGR, max drawdown, annualised volatility and Sharpe ratio of the time-weighted daily returns
+    of curve, which exclude the effect of contributions, and the money-weighted IRR of the
+    contributions against the final equity.
+    """
+    equity = curve["Equity"].to_numpy()
+    contributed = curve["Contributions"].to_numpy()
+    if len(curve) < 2:
+        return dict.fromkeys(METRICS, np.nan)
+    flows = np.diff(contributed)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = (equity[1:] - flows) / equity[:-1] - 1
+    returns = returns[np.isfinite(returns)]
+    growth = np.cumprod(1 + returns)
+    dates = curve["Date"].to_numpy()
+    years = (dates[-1] - dates[0]) / np.timedelta64(1, "D") / DAYS_PER_YEAR
+    periods_per_year = len(returns) / years if years > 0 else np.nan
+    volatility = returns.std(ddof=1) * np.sqrt(periods_per_year) if len(returns) > 1 else np.nan
+    excess = returns.mean() * periods_per_year - risk_free if len(returns) else np.nan
+
+    # Money weighted: every contribution paid in, the final equity taken out
+    paid_in = np.flatnonzero(np.diff(contributed, prepend=0.0))
+    amounts = np.append(-np.diff(contributed, prepend=0.0)[paid_in], equity[-1])
+    flow_years = (np.append(dates[paid_in], dates[-1]) - dates[0]) / np.timedelta64(1, "D") / DAYS_PER_YEAR
+    return {
+        "cagr": growth[-1] ** (1 / years) - 1 if years > 0 and len(growth) else np.nan,
+        # The starting level counts as a peak, a curve falling from day one is in drawdown
+        "max_drawdown": float(1 - (growth / np.maximum.accumulate(np.maximum(growth, 1.0))).min())
+        if len(growth) else np.nan,
+        "volatility": volatility,
+        "sharpe": excess / volatility if volatility else np.nan,
+        "irr": irr(amounts, flow_years),
+    }
+
+
+def write_table(frame: pd.DataFrame, path: str) -> str:
+    """Writes frame as Parquet for a .parquet path, falling back to csv without pyarrow, else as csv."""
+    if path.endswith(".parquet"):
+        try:
+            frame.to_parquet(path, index=False)
+            return path
+        except ImportError:
+            logging.warning("pyarrow is not installed, writing %s as csv instead", path)
+            path = os.path.splitext(path)[0] + ".csv"
+    frame.to_csv(path, index=False)
+    return path
@@ -0,0 +1,127 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import numpy as np
+import pandas as pd
+from dca_engine import calc_brokerage_cost, monthly_schedule
+from fx_align import FX_COLUMN, align_fx
+from strategies import strategy_buys
+
+# Price columns of a simulated bar, each resampled as a ratio to the previous close
+PATH_COLUMNS = ("Open", "High", "Low", "Close")
+# Trading days resampled together, long enough to keep a month of volatility clustering and the AUD
+# moves of the same days
+BLOCK_DAYS = 20
+PATHS = 2000
+# Paths simulated per task, bounds the memory of a task to about CHUNK_PATHS x days x 5 floats
+CHUNK_PATHS = 250
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def day_ratios(bars: pd.DataFrame) -> np.ndarray:
+    """
+    Every day of bars (aligned by align_fx) as its open, high, low and close over the previous close
+    and its AUD rate over the previous one, days x 5. Days missing any of them are left out.
+    """
+    closes = bars["Close"].to_numpy(dtype=float)
+    rates = bars[FX_COLUMN].to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = np.column_stack([bars[column].to_numpy(dtype=float)[1:] / closes[:-1] for column in PATH_COLUMNS]
+                                 + [rates[1:] / rates[:-1]])
+    return ratios[np.isfinite(ratios).all(axis=1)]
+
+
+def bootstrap_paths(ratios: np.ndarray, first: np.ndarray, days: int, paths: int, block_days: int,
+                    rng: np.random.Generator) -> dict:
+    """
+    paths synthetic histories of days bars from the bar first (open, high, low, close, AUD rate),
+    each the concatenation of randomly drawn blocks of block_days consecutive day ratios. A day's
+    prices and AUD rate are drawn together, so their correlation survives. Returns the bars as
+    {column: paths x days array}, the shape strategy_buys takes.
+    """
+    block_days = min(block_days, len(ratios))
+    blocks = -(-(days - 1) // block_days)
+    starts = rng.integers(0, len(ratios) - block_days + 1, size=(paths, blocks))
+    sampled = ratios[(starts[:, :, None] + np.arange(block_days)).reshape(paths, -1)[:, :days - 1]]
+    closes = first[3] * np.cumprod(sampled[..., 3], axis=1)
+    previous = np.concatenate([np.full((paths, 1), first[3]), closes[:, :-1]], axis=1)
+    bars = {column: np.concatenate([np.full((paths, 1), first[i]), previous * sampled[..., i]], axis=1)
+            for i, column in enumerate(PATH_COLUMNS)}
+    bars[FX_COLUMN] = np.concatenate([np.full((paths, 1), first[4]), first[4] * np.cumprod(sampled[..., 4], axis=1)],
+                                     axis=1)
+    return bars
+
+
+def simulate_dca(bars: dict, dates: np.ndarray, schedule: np.ndarray, asset_type: str, amount_added: float,
+                 strategy: str, fees: dict = None):
+    """
+    backtest_bars' buys on every path of bars at once, without dividends. Returns the final value
+    in AUD and the total invested of each path.
+    """
+    buys, prices = strategy_buys(bars, dates, schedule, strategy)
+    closes, rates = bars["Close"], bars[FX_COLUMN]
+    buys = np.broadcast_to(buys, (len(closes), len(schedule)))
+    bought = buys >= 0
+    buys = np.where(bought, buys, 0)
+    usd_aud = np.take_along_axis(rates, buys, axis=1)
+    invested, _ = calc_brokerage_cost({"type": asset_type}, float(amount_added), usd_aud, fees)
+    invested = np.where(bought, invested, 0.0)
+    units = invested / usd_aud / np.take_along_axis(prices, buys, axis=1)
+    return units.sum(axis=1) * closes[:, -1] * rates[:, -1], invested.sum(axis=1)
+
+
+def _simulate_chunk(ratios: np.ndarray, first: np.ndarray, dates: np.ndarray, schedule: np.ndarray, asset_type: str,
+                    strategies, amounts, paths: int, block_days: int, seed: np.random.SeedSequence,
+                    fees: dict) -> dict:
+    """One chunk of paths, every strategy and amount run on the same paths. {(strategy, amount): (values, totals)}"""
+    bars = bootstrap_paths(ratios, first, len(dates), paths, block_days, np.random.default_rng(seed))
+    return {(strategy, amount): simulate_dca(bars, dates, schedule, asset_type, amount, strategy, fees)
+            for strategy, amount in product(strategies, amounts)}
+
+
+def run_monte_carlo(histories: dict, asset_types: dict, strategies, start, amounts, end, paths: int = PATHS,
+                    block_days: int = BLOCK_DAYS, workers: int = None, seed: int = None,
+                    fees: dict = None) -> pd.DataFrame:
+    """
+    Monthly DCA from start to end on paths block bootstrapped histories of every ticker of asset_types,
+    for every strategy and amount. Returns the percentiles of the final value and of the return per
+    ticker, strategy and amount. histories holds each ticker's bars and AUD=X, end may be one date or a
+    {ticker: date} mapping.
+
+    The paths keep the ticker's trading days from start, so every path buys on the same schedule,
+    and are resampled from the ticker's whole history. Chunks of CHUNK_PATHS paths run on a process
+    pool, each path array lives only in its task.
+    """
+    ends = end if isinstance(end, dict) else dict.fromkeys(asset_types, end)
+    seeds = iter(np.random.SeedSequence(seed).spawn(len(asset_types) * -(-paths // CHUNK_PATHS)))
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {}
+        for ticker, asset_type in asset_types.items():
+            bars = align_fx(histories[ticker], histories["AUD=X"]).dropna(subset=list(PATH_COLUMNS) + [FX_COLUMN])
+            dates = bars["Date"].to_numpy().astype("datetime64[D]")
+            first = np.searchsorted(dates, np.datetime64(pd.Timestamp(start), "D"), side="left")
+            last = np.searchsorted(dates, np.datetime64(pd.Timestamp(ends[ticker]), "D"), side="right") - 1
+            if first >= last:
+                continue
+            ratios = day_ratios(bars.iloc[:last + 1])
+            first_bar = bars[list(PATH_COLUMNS) + [FX_COLUMN]].to_numpy(dtype=float)[first]
+            schedule = monthly_schedule(start, ends[ticker])
+            futures[ticker] = [executor.submit(_simulate_chunk, ratios, first_bar, dates[first:last + 1], schedule,
+                                               asset_type, strategies, amounts, min(CHUNK_PATHS, paths - done),
+                                               block_days, next(seeds), fees)
+                               for done in range(0, paths, CHUNK_PATHS)]
+        for ticker, chunks in futures.items():
+            chunks = [future.result() for future in chunks]
+            for strategy, amount in product(strategies, amounts):
+                values = np.concatenate([chunk[strategy, amount][0] for chunk in chunks])
+                totals = np.concatenate([chunk[strategy, amount][1] for chunk in chunks])
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    returns = values / totals - 1
+                rows.append({"Ticker": ticker, "Strategy": strategy, "Amount": amount, "Paths": len(values),
+                             "Total Added": float(np.median(totals)),
+                             **dict(zip((f"Value P{q}" for q in PERCENTILES), np.percentile(values, PERCENTILES))),
+                             **dict(zip((f"Return P{q}" for q in PERCENTILES),
+                                        np.nanpercentile(returns, PERCENTILES)))})
+    return pd.DataFrame(rows, columns=["Ticker", "Strategy", "Amount", "Paths", "Total Added",
+                                       *(f"Value P{q}" for q in PERCENTILES), *(f"Return P{q}" for q in PERCENTILES)])
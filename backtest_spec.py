@@ -0,0 +1,121 @@
+import copy
+import hashlib
+import json
+import os
+import pandas as pd
+from backtest_sweep import RESULT_COLUMNS
+from dca_engine import DIVIDEND_WITHHOLDING, FEE_SCHEDULE
+
+BACKTEST_RESULTS_DIR = "backtest_results"
+RESULTS_TABLE = "results"
+# Bump when the engine's results change, results cached by an older engine are then never reused
+RESULTS_VERSION = 1
+# The built-in backtest, an end of None is today
+DEFAULT_SPEC = {
+    "tickers": ["BTC-USD", "SOL-USD", "ETH-USD", "XRP-USD", "SPUS"],
+    "strategy": "Blind",
+    "start": "2024-01-15",
+    "end": None,
+    "amount_added": 100,
+    "fees": FEE_SCHEDULE,
+    "withholding": DIVIDEND_WITHHOLDING,
+    "reinvest_dividends": False,
+}
+
+
+def load_spec(path: str = None) -> dict:
+    """
+    The backtest spec in the JSON file at path, over DEFAULT_SPEC. fees and withholding are merged
+    per asset type, so a spec only lists what it changes. Raises ValueError for unknown fields.
+    """
+    spec = copy.deepcopy(DEFAULT_SPEC)
+    if path is None:
+        return spec
+    with open(path) as fp:
+        loaded = json.load(fp)
+    unknown = set(loaded) - set(DEFAULT_SPEC)
+    if unknown:
+        raise ValueError(f"unknown fields {', '.join(sorted(unknown))}")
+    for asset_type, fee in loaded.pop("fees", {}).items():
+        spec["fees"][asset_type] = {**spec["fees"].get(asset_type, {}), **fee}
+    spec["withholding"].update(loaded.pop("withholding", {}))
+    spec.update(loaded)
+    return spec
+
+
+def result_key(spec: dict, ticker: str, asset_type: str, strategy: str, start, end, amount_added: float,
+               versions) -> str:
+    """
+    The cache key of one ticker's backtest under spec: a hash of everything its result depends on,
+    with versions the HistoryCache versions of the ticker's and AUD=X's bars. None when either is not
+    cached, the result can't be keyed then.
+
+    The end counts by its day: an end during a day buys and values like the end of that day, no bar
+    past it has been fetched yet, so runs on the same day share their results.
+    """
+    if None in versions:
+        return None
+    payload = json.dumps({
+        "engine": RESULTS_VERSION, "ticker": ticker, "strategy": strategy,
+        "start": pd.Timestamp(start).isoformat(), "end": pd.Timestamp(end).ceil("D").isoformat(),
+        "amount_added": float(amount_added), "fees": spec["fees"].get(asset_type),
+        "withholding": spec["withholding"].get(asset_type, 0.0), "reinvest": bool(spec["reinvest_dividends"]),
+        "data": list(versions),
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Backtest results by result_key: the results table row of every configuration in one table, and
+    the equity curve of the single runs next to it, one file each. Parquet, a pickle without pyarrow.
+    """
+
+    def __init__(self, cache_dir: str = BACKTEST_RESULTS_DIR):
+        self.cache_dir = cache_dir
+        table = _read_frame(os.path.join(cache_dir, RESULTS_TABLE))
+        self.rows = {} if table is None else table.set_index("Key").to_dict("index")
+        self.changed = False
+
+    def read(self, key: str):
+        return self.rows.get(key) if key is not None else None
+
+    def result(self, key: str):
+        """The scalar results and equity curve of a single run, as run_backtest returns them, or None."""
+        row = self.read(key)
+        curve = _read_frame(os.path.join(self.cache_dir, "curves", key)) if row is not None else None
+        if curve is None:
+            return None
+        return {**{name: row[column] for name, column in RESULT_COLUMNS.items()}, "curve": curve}
+
+    def write(self, key: str, row: dict, curve: pd.DataFrame = None):
+        if key is None:
+            return
+        self.rows[key] = row
+        self.changed = True
+        if curve is not None:
+            os.makedirs(os.path.join(self.cache_dir, "curves"), exist_ok=True)
+            _write_frame(curve, os.path.join(self.cache_dir, "curves", key))
+
+    def save(self):
+        if not self.changed:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        table = pd.DataFrame.from_dict(self.rows, orient="index").rename_axis("Key").reset_index()
+        _write_frame(table, os.path.join(self.cache_dir, RESULTS_TABLE))
+        self.changed = False
+
+
+def _write_frame(frame: pd.DataFrame, base: str):
+    try:
+        frame.to_parquet(base + ".parquet", index=False)
+    except ImportError:
+        frame.to_pickle(base + ".pkl")
+
+
+def _read_frame(base: str):
+    if os.path.exists(base + ".parquet"):
+        return pd.read_parquet(base + ".parquet")
+    if os.path.exists(base + ".pkl"):
+        return pd.read_pickle(base + ".pkl")
+    return None
@@ -0,0 +1,158 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from dca_engine import backtest_bars
+from fx_align import FX_COLUMN, align_fx
+
+# Bar columns the backtests read, packed side by side after the date into one shared float block
+SHARED_COLUMNS = ("Open", "High", "Low", "Close", "Dividends", FX_COLUMN)
+# run_backtest results kept per configuration, and their column in the results table
+RESULT_COLUMNS = {"total": "Total Added", "brokerage": "Brokerage", "units": "Units", "dca_price": "DCA Price",
+                  "final_price": "Final Price", "final_rate": "AUD Rate", "value": "Value", "return": "Return",
+                  "dividends": "Dividend Income", "dividend_tax": "Dividend Tax", "cagr": "CAGR",
+                  "max_drawdown": "Max Drawdown", "volatility": "Volatility", "sharpe": "Sharpe", "irr": "IRR"}
+# Tasks per worker, enough for uneven tasks to even out across the pool
+TASKS_PER_WORKER = 4
+
+
+def result_row(result: dict) -> dict:
+    """The results table columns of a run_backtest result."""
+    return {"Buys": len(result["buys"]), **{column: result[key] for key, column in RESULT_COLUMNS.items()}}
+
+
+class SharedBars:
+    """
+    The FX-aligned bars of many tickers in one shared memory block, one row per bar with the date
+    (days since the epoch) first. The parent process creates it once, pool workers attach to it
+    by name and read views of it, so the histories are never copied into the tasks.
+    """
+
+    def __init__(self, name: str, shape: tuple, spans: dict):
+        self.name = name
+        self.shape = shape
+        self.spans = spans
+        self.memory = None
+
+    @classmethod
+    def create(cls, bars_by_ticker: dict):
+        spans, rows = {}, 0
+        for ticker, bars in bars_by_ticker.items():
+            spans[ticker] = (rows, rows + len(bars))
+            rows += len(bars)
+        shape = (max(rows, 1), len(SHARED_COLUMNS) + 1)
+        memory = shared_memory.SharedMemory(create=True, size=8 * shape[0] * shape[1])
+        shared = cls(memory.name, shape, spans)
+        shared.memory = memory
+        block = shared.block()
+        for ticker, bars in bars_by_ticker.items():
+            first, last = spans[ticker]
+            block[first:last, 0] = bars["Date"].to_numpy().astype("datetime64[D]").astype("int64")
+            block[first:last, 1:] = bars[list(SHARED_COLUMNS)].to_numpy(dtype=float)
+        return shared
+
+    def __getstate__(self):
+        # Only the name travels to the workers, they attach to the block themselves
+        return {"name": self.name, "shape": self.shape, "spans": self.spans, "memory": None}
+
+    def attach(self):
+        self.memory = shared_memory.SharedMemory(name=self.name)
+
+    def block(self) -> np.ndarray:
+        return np.ndarray(self.shape, dtype=np.float64, buffer=self.memory.buf)
+
+    def bars(self, ticker: str) -> pd.DataFrame:
+        first, last = self.spans[ticker]
+        rows = self.block()[first:last]
+        bars = pd.DataFrame(rows[:, 1:], columns=list(SHARED_COLUMNS), copy=False)
+        bars.insert(0, "Date", rows[:, 0].astype("int64").astype("datetime64[D]").astype("datetime64[ns]"))
+        return bars
+
+    def close(self, unlink: bool = False):
+        if self.memory is not None:
+            self.memory.close()
+            if unlink:
+                self.memory.unlink()
+            self.memory = None
+
+
+# Set in each pool worker by _attach_worker
+_worker_shared = None
+_worker_bars = {}
+
+
+def _attach_worker(shared: SharedBars):
+    global _worker_shared
+    shared.attach()
+    _worker_shared = shared
+
+
+def _run_task(ticker: str, asset_type: str, strategy: str, starts, amounts, end, withholding: dict,
+              reinvest: bool, curves: bool, fees: dict, skip: set):
+    """
+    Backtests one ticker and strategy for every start date and amount, on the worker's shared bars.
+    Returns the result rows, and their equity curves when asked for. Start and amount pairs in skip
+    are left out, their results are known already.
+    """
+    if ticker not in _worker_bars:
+        _worker_bars[ticker] = _worker_shared.bars(ticker)
+    bars = _worker_bars[ticker]
+    rows, task_curves = [], []
+    for start, amount in product(starts, amounts):
+        if (start, amount) in skip:
+            continue
+        result = backtest_bars(bars, asset_type, start, end, amount, strategy, withholding=withholding,
+                               reinvest=reinvest, fees=fees)
+        config = {"Ticker": ticker, "Strategy": strategy, "Start": pd.Timestamp(start), "Amount": amount}
+        rows.append({**config, **result_row(result)})
+        if curves:
+            task_curves.append(result["curve"].assign(**config))
+    return rows, task_curves
+
+
+def monthly_starts(spec: str) -> list:
+    """A start date, or FROM:TO for the same day of every month from FROM up to TO."""
+    first, _, last = spec.partition(":")
+    if not last:
+        return [pd.Timestamp(first)]
+    return list(pd.date_range(first, last, freq=pd.DateOffset(months=1)))
+
+
+def run_sweep(histories: dict, asset_types: dict, strategies, starts, amounts, end, workers: int = None,
+              withholding: dict = None, reinvest: bool = False, curves: bool = False, fees: dict = None,
+              skip=()):
+    """
+    Backtests every ticker of asset_types x strategy x start date x amount on a process pool and
+    returns one row per configuration, with its risk metrics, plus every equity curve in one long
+    frame when curves is set (None otherwise). histories holds each ticker's bars and AUD=X, end
+    may be one date or a {ticker: date} mapping. Configurations in skip, (ticker, strategy, start,
+    amount) tuples, are not backtested and have no row.
+
+    Each ticker is joined with AUD=X once here and shared with the workers through SharedBars.
+    Tasks are a ticker and strategy with a slice of the start dates, small enough to keep every
+    worker busy.
+    """
+    tickers = list(asset_types)
+    ends = end if isinstance(end, dict) else dict.fromkeys(tickers, end)
+    shared = SharedBars.create({ticker: align_fx(histories[ticker], histories["AUD=X"]) for ticker in tickers})
+    try:
+        workers = workers or os.cpu_count()
+        chunks = max(1, min(len(starts), -(-workers * TASKS_PER_WORKER // max(len(tickers) * len(strategies), 1))))
+        start_chunks = [chunk for chunk in np.array_split(np.asarray(starts, dtype=object), chunks) if len(chunk)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_worker, initargs=(shared,)) as executor:
+            futures = [executor.submit(_run_task, ticker, asset_types[ticker], strategy, list(chunk), amounts,
+                                       ends[ticker], withholding, reinvest, curves, fees,
+                                       {(start, amount) for start, amount in product(chunk, amounts)
+                                        if (ticker, strategy, start, amount) in skip})
+                       for ticker, strategy, chunk in product(tickers, strategies, start_chunks)]
+            rows, all_curves = [], []
+            for future in futures:
+                task_rows, task_curves = future.result()
+                rows += task_rows
+                all_curves += task_curves
+    finally:
+        shared.close(unlink=True)
+    results = pd.DataFrame(rows, columns=["Ticker", "Strategy", "Start", "Amount", "Buys", *RESULT_COLUMNS.values()])
+    return results, pd.concat(all_curves, ignore_index=True) if all_curves else None
@@ -0,0 +1,118 @@
+from itertools import product
+import numpy as np
+import pandas as pd
+from backtest_metrics import DAYS_PER_YEAR, irr
+from dca_engine import DIVIDEND_WITHHOLDING, calc_brokerage_cost, monthly_schedule
+from fx_align import FX_COLUMN, align_fx
+from strategies import strategy_buys
+
+# Columns of the walk-forward table after Ticker, Strategy, Start and Amount
+WALK_FORWARD_COLUMNS = ("Buys", "Total Added", "Brokerage", "Units", "DCA Price", "Value", "Return",
+                        "Dividend Income", "Dividend Tax", "IRR")
+
+
+def suffix_sum(values: np.ndarray) -> np.ndarray:
+    """suffix_sum(values)[k] is values[k:].sum(), with a trailing 0 for the empty suffix."""
+    return np.append(np.cumsum(values[::-1])[::-1], 0.0)
+
+
+def walk_forward(bars: pd.DataFrame, asset_type: str, start, end, amount_added: float, strategy: str = "Blind",
+                 withholding: dict = None, reinvest: bool = False, fees: dict = None) -> pd.DataFrame:
+    """
+    backtest_bars for every start month from start up to end at once, one row per start date.
+
+    Starting k months later buys on the same days minus the first k, so every start shares one
+    schedule and one set of buys, and what a start adds up to is a suffix of them: the totals are
+    suffix sums over the buys, the dividends suffix sums over the ex-dividend days weighted by the
+    units held going into them. O(buys + events) for all starts, where replaying each start is
+    O(buys²). The IRR alone is solved per start, its cash flows are the suffix of the schedule.
+    """
+    dates = bars["Date"].to_numpy().astype("datetime64[D]")
+    rates = bars[FX_COLUMN].to_numpy()
+    schedule = monthly_schedule(start, end)
+    buys, buy_prices = strategy_buys(bars, dates, schedule, strategy)
+    # Buys that never find their day are the tail of the schedule, drop them as backtest_bars does
+    buys = buys[buys >= 0]
+    prices = buy_prices[buys]
+    usd_aud = rates[buys]
+    invested, brokerage = calc_brokerage_cost({"type": asset_type}, float(amount_added), usd_aud, fees)
+    invested = np.broadcast_to(invested, buys.shape)
+    brokerage = np.broadcast_to(brokerage, buys.shape)
+    units = invested / usd_aud / prices
+    last = np.searchsorted(dates, np.datetime64(pd.Timestamp(end), "D"), side="right") - 1
+
+    # Ex-dividend days as in dividend_events. A unit bought at buy j grows to growth[-1] / growth[after j]
+    # units by the end, so the units start k holds going into event e are growth[e] * (scaled[b(e)] - scaled[k])
+    # for the b(e) buys before e, and what the events pay start k is a suffix sum minus scaled[k] times another
+    per_unit = bars["Dividends"].to_numpy(dtype=float)[:last + 1]
+    events = np.flatnonzero(per_unit != 0)
+    gross_per_unit = per_unit[events]
+    net_per_unit = gross_per_unit * (1 - (withholding or DIVIDEND_WITHHOLDING).get(asset_type, 0.0))
+    if reinvest:
+        growth = np.concatenate([[1.0], np.cumprod(1 + net_per_unit / bars["Close"].to_numpy(dtype=float)[events])])
+    else:
+        growth = np.ones(len(events) + 1)
+    scaled = np.concatenate([[0.0], np.cumsum(units / growth[np.searchsorted(events, buys, side="right")])])
+    bought_before = np.searchsorted(buys, events, side="left")
+    event_rates = rates[events]
+    net_weights = net_per_unit * event_rates * growth[:-1]
+    tax_weights = (gross_per_unit - net_per_unit) * event_rates * growth[:-1]
+    # The events start k holds units for are those with a buy of its own before them, a suffix of the events
+    starts = np.arange(len(buys) + 1)
+    first_event = np.searchsorted(bought_before, starts, side="right")
+    held_scaled = scaled[bought_before]
+
+    def dividends_from(weights):
+        return suffix_sum(weights * held_scaled)[first_event] - scaled[starts] * suffix_sum(weights)[first_event]
+
+    net = dividends_from(net_weights)
+    tax = dividends_from(tax_weights)
+    total = suffix_sum(invested)
+    final_units = growth[-1] * (scaled[-1] - scaled)
+    bought_units = suffix_sum(units)
+    final_price = float(bars["Close"].iloc[last])
+    value = final_units * final_price * float(rates[last])
+
+    # Money weighted per start: amount_added on every buy day, the value and paid out dividends at the end
+    years = (dates[buys] - dates[last]) / np.timedelta64(1, "D") / DAYS_PER_YEAR
+    paid_out = value + (0.0 if reinvest else net)
+    irrs = [irr(np.append(np.full(len(buys) - k, -float(amount_added)), paid_out[k]), np.append(years[k:], 0.0))
+            for k in range(len(buys))]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        table = pd.DataFrame({
+            "Start": schedule[:len(buys)].astype("datetime64[ns]"),
+            "Buys": len(buys) - starts[:-1],
+            "Total Added": total[:-1],
+            "Brokerage": suffix_sum(brokerage)[:-1],
+            "Units": final_units[:-1],
+            "DCA Price": suffix_sum(prices * units)[:-1] / bought_units[:-1],
+            "Value": value[:-1],
+            "Return": value[:-1] / total[:-1] - 1,
+            "Dividend Income": net[:-1],
+            "Dividend Tax": tax[:-1],
+            "IRR": irrs,
+        })
+    return table
+
+
+def run_walk_forward(histories: dict, asset_types: dict, strategies, start, amounts, end, withholding: dict = None,
+                     reinvest: bool = False, fees: dict = None) -> pd.DataFrame:
+    """
+    walk_forward for every ticker of asset_types x strategy x amount, one long table with a row per
+    start date. histories holds each ticker's bars and AUD=X, end may be one date or a {ticker: date}
+    mapping.
+    """
+    ends = end if isinstance(end, dict) else dict.fromkeys(asset_types, end)
+    tables = []
+    for ticker, asset_type in asset_types.items():
+        bars = align_fx(histories[ticker], histories["AUD=X"])
+        for strategy, amount in product(strategies, amounts):
+            table = walk_forward(bars, asset_type, start, ends[ticker], amount, strategy, withholding, reinvest,
+                                 fees)
+            table.insert(0, "Ticker", ticker)
+            table.insert(1, "Strategy", strategy)
+            table.insert(3, "Amount", amount)
+            tables.append(table)
+    columns = ["Ticker", "Strategy", "Start", "Amount", *WALK_FORWARD_COLUMNS]
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=columns)
@@ -1,260 +1,223 @@
-import yfinance as yf
-from requests_cache import CachedSession
-from datetime import datetime, timezone, timedelta, date
+import argparse
+from datetime import datetime, timezone, date
+from itertools import product
 from dateutil.relativedelta import relativedelta
 from zoneinfo import ZoneInfo
 import pandas as pd
+from backtest_data import HistoryCache, load_histories
+from backtest_metrics import write_table
+from backtest_spec import ResultCache, load_spec, result_key
+from backtest_sweep import result_row
+from dca_engine import run_backtest
+from profiling import enable, span
+from strategies import STRATEGIES
 
 Crypto = ("SOL-USD", "BTC-USD", "ETH-USD", "ADA-USD", "XRP-USD")
 US_Shares = ("SPUS", "AAPL", "NVDA", "REIT", "VOO")
 
 
-def calc_brokerage_cost(ticker_type: dict, amount_aud: int, usd_aud_rate):
-    ticker_category = ticker_type["type"]
-    if ticker_category == "Cryptocurrency":
-        # Coinspot
-        brokerage_cost = 0.01 * amount_aud
-        remaining_amount = amount_aud - brokerage_cost
-    elif ticker_category == "US_Shares":
-        # Stake
-        brokerage_cost = (0.007 * amount_aud + 3) * usd_aud_rate
-        usd = amount_aud / usd_aud_rate
-        remaining_amount = (usd - brokerage_cost) * usd_aud_rate
-    return remaining_amount, brokerage_cost
-
-
-def calc_dividends(ticker_type, total_units, dividends, buy_date: datetime, prev_month_buy_day: int, tz_string: str):
-    start_date = buy_date
-    month_delta = relativedelta(months=1)
-    if prev_month_buy_day == 0:
-        start_date = start_date.replace(day=1)
-    else:
-        start_date -= month_delta
-        start_date = start_date.replace(day=prev_month_buy_day)
-    delta = timedelta(days=1)
-    found = False
-    while start_date <= buy_date:
-        full_date_string = f"{start_date.strftime('%Y-%m-%d')} 00:00:00{tz_string}"
-        pd_date_index = pd.DatetimeIndex(data=[full_date_string])
-        try:
-            dividend_per_unit = dividends.loc[pd_date_index][0]
-            if dividend_per_unit == 0.0:
-                start_date += delta
-                continue
-            found = True
-            break
-        except KeyError:
-            start_date += delta
-            continue
-        except Exception as e:
-            print(e)
-    if found:
-        # print(f"Dividend found for buying period: {end_date.strftime('%Y-%m-%d')} = {dividend_per_unit}")0.0
-        dividend_payout = dividend_per_unit * total_units
-        if ticker_type["type"] == "US_Shares":
-            tax = dividend_payout * 0.15
-        net_dividend_payout = dividend_payout - tax
-        # print(
-        # f"Total Dividend payout: {dividend_payout}; Total dividend tax: {tax}; Total net: {net_dividend_payout}")
-        return net_dividend_payout
-    return 0
-
-
-def closest_aud_price(aud_prices, buy_date: datetime):
-    found = False
-    delta = timedelta(days=1)
-    start_date = datetime(year=buy_date.year, month=buy_date.month,
-                          day=buy_date.day, tzinfo=ZoneInfo(key="Europe/Belfast"))
-    while not found:
-        utc_offset_str = get_utc_offset_str(date=start_date)
-        full_date_string = f"{start_date.strftime('%Y-%m-%d')} 00:00:00{utc_offset_str}"
-        pd_date_index = pd.DatetimeIndex(data=[full_date_string])
+def get_ticker_type(ticker: str) -> dict:
+    if ticker in Crypto:
+        return {
+            "type": "Cryptocurrency",
+            "timezone": ZoneInfo(key="Etc/Greenwich"),
+            "tz_string_dst": "+00"
+
+        }
+    elif ticker in US_Shares:
+        return {
+            "type": "US_Shares",
+            "timezone": ZoneInfo(key="America/New_York"),
+            "tz_string_dst": "-05"
+        }
+    print(f"Error: {ticker} is neither in Crypto nor in US_Shares, add it to one of them")
+    exit(1)
+
+
+def add_sweep_arguments(parser: argparse.ArgumentParser):
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--sweep", action="store_true",
+                      help="Backtest every combination of the options below on a process pool.")
+    mode.add_argument("--walk-forward", action="store_true",
+                      help="Backtest every start month from the first start date (the start of the 5 year window "
+                           "by default) up to today, or up to TO, for every ticker, strategy and amount at once.")
+    mode.add_argument("--monte-carlo", action="store_true",
+                      help="Simulate DCA from the first start date on block bootstrapped price and AUD=X paths and "
+                           "report the percentiles of the final value and return.")
+    parser.add_argument("--tickers", nargs="+", help="Tickers to sweep. (Defaults to the built-in tickers)")
+    parser.add_argument("--strategies", nargs="+", help=f"Any of: {', '.join(STRATEGIES)}.")
+    parser.add_argument("--start-dates", nargs="+", metavar="DATE[:TO]",
+                        help="Start dates, FROM:TO for the same day of every month in between.")
+    parser.add_argument("--amounts", nargs="+", type=float, help="Monthly contributions in AUD.")
+    parser.add_argument("--workers", type=int, help="Number of worker processes. (Defaults to the number of CPUs)")
+    parser.add_argument("--paths", type=int, help="Simulated paths per ticker. (Defaults to 2000)")
+    parser.add_argument("--block-days", type=int, help="Trading days per resampled block. (Defaults to 20)")
+    parser.add_argument("--seed", type=int, help="Seed of the simulation, for repeatable results.")
+    parser.add_argument("--output", help="Results table, Parquet or csv by extension. "
+                                         "(Defaults to backtest_<mode>.parquet)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest monthly dollar cost averaging into a set of tickers.")
+    parser.add_argument("--profile", metavar="JSON", help="Write named timing spans for this run to a JSON file.")
+    parser.add_argument("--spec", metavar="JSON",
+                        help="Backtest spec: tickers, strategy, start, end, amount_added, fees, withholding and "
+                             "reinvest_dividends, each defaulting to the built-in backtest.")
+    parser.add_argument("--recompute", action="store_true",
+                        help="Backtest everything again instead of reusing the cached results.")
+    parser.add_argument("--offline", action="store_true", help="Backtest from the cached histories only.")
+    parser.add_argument("--curves", metavar="PATH",
+                        help="Daily equity curves, Parquet or csv by extension. (Defaults to backtest_curves.parquet "
+                             "for a single run, a sweep only writes them when given)")
+    parser.add_argument("--reinvest-dividends", action="store_true",
+                        help="Buy more units with each net dividend instead of paying it out.")
+    parser.add_argument("--withholding", nargs="+", metavar="TYPE=RATE", default=[],
+                        help="Dividend withholding per asset type, e.g. US_Shares=0.3. "
+                             "(Defaults to US_Shares=0.15 Cryptocurrency=0)")
+    add_sweep_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.profile:
+        enable("backtester", args.profile)
+
+    try:
+        spec = load_spec(args.spec)
+    except (OSError, ValueError) as e:
+        print(f"Error: Could not read the backtest spec {args.spec}: {e}")
+        exit(1)
+    for entry in args.withholding:
+        asset_type, _, rate = entry.partition("=")
         try:
-            aud_price = aud_prices["Close"].loc[pd_date_index][0]
-            found = True
-        except KeyError:
-            start_date -= delta
-        except Exception as e:
-            print(e)
-    return aud_price
-
-
-def get_utc_offset_str(date: datetime):
-    utc_offset = date.utcoffset()
-    utc_offset_hours = utc_offset.total_seconds() // 3600
-    utc_offset_minutes = (utc_offset.total_seconds() % 3600) // 60
-    offset_str = f"{'+' if utc_offset_hours >= 0 else '-'}{'0' if utc_offset_hours < 10 else ''}{abs(int(utc_offset_hours))}:{int(utc_offset_minutes):02d}"
-    return offset_str
-
-
-def get_datetime_index(date: datetime):
-    date_string = date.strftime('%Y-%m-%d')
-    utc_offset_str = get_utc_offset_str(date=date)
-    full_date_string = f"{date_string} 00:00:00{utc_offset_str}"
-    return pd.DatetimeIndex(data=[full_date_string])
-
-
-def strategy_price(ticker_prices: pd.DataFrame, initial_buy_date: datetime, strategy: str):
-    strategies = ("Blind", "Red Day", "Red Low", "Red Day-5", "Red Day-10")
-    day_delta = timedelta(days=1)
-    if strategy not in strategies:
+            spec["withholding"][asset_type] = float(rate)
+        except ValueError:
+            print(f"Error: Withholding must be TYPE=RATE, got {entry}")
+            exit(1)
+    spec["reinvest_dividends"] = spec["reinvest_dividends"] or args.reinvest_dividends
+    tickers = tuple(spec["tickers"])
+    strategy = spec["strategy"]
+    start = pd.Timestamp(spec["start"])
+    amount_added = spec["amount_added"]
+    withholding, reinvest, fees = spec["withholding"], spec["reinvest_dividends"], spec["fees"]
+    if args.sweep or args.walk_forward or args.monte_carlo:
+        tickers = tuple(args.tickers or tickers)
+    for name in (args.strategies or []) + [strategy]:
+        if name not in STRATEGIES:
+            print(f"Error: Unknown strategy {name}, expected one of {', '.join(STRATEGIES)}")
+            exit(1)
+
+    # Every ticker and the exchange rate loaded once for the run, from the cache where it is fresh
+    window_start = datetime.now() - relativedelta(years=5)
+    with span("data_load"):
+        histories, errors = load_histories(tickers + ("AUD=X",), window_start.strftime("%Y-%m-%d"),
+                                           offline=args.offline)
+    if "AUD=X" not in histories:
+        print(f"Error: Could not load AUD=X prices: {errors['AUD=X']}")
         exit(1)
-
-    if strategy == "Blind":
-        return ticker_prices["Close"].loc[get_datetime_index(date=initial_buy_date)][0], initial_buy_date
-    elif strategy == "Red Day":
-        open_price = ticker_prices["Open"].loc[get_datetime_index(
-            date=initial_buy_date)][0]
-        strat_price = ticker_prices["Close"].loc[get_datetime_index(
-            date=initial_buy_date)][0]
-        if strat_price < open_price:
-            # print(f"{strat_price=} < {open_price=}")
-            return strat_price, initial_buy_date
-        else:
-            found = False
-            strategy_buy_date = initial_buy_date
-            while not found:
-                strategy_buy_date += day_delta
-                try:
-                    open_price = ticker_prices["Open"].loc[get_datetime_index(
-                        date=strategy_buy_date)][0]
-                    strat_price = ticker_prices["Close"].loc[get_datetime_index(
-                        date=strategy_buy_date)][0]
-                    if strat_price < open_price:
-                        # print(f"{strat_price=} < {open_price=}")
-                        return strat_price, strategy_buy_date
-                except KeyError:
-                    continue
-    elif strategy == "Red Low":
-        open_price = ticker_prices["Open"].loc[get_datetime_index(
-            date=initial_buy_date)][0]
-        strat_price = ticker_prices["Low"].loc[get_datetime_index(
-            date=initial_buy_date)][0]
-        if strat_price < open_price:
-            # print(f"{strat_price=} < {open_price=}")
-            return strat_price, initial_buy_date
-        else:
-            found = False
-            strategy_buy_date = initial_buy_date
-            while not found:
-                strategy_buy_date += day_delta
-                try:
-                    open_price = ticker_prices["Open"].loc[get_datetime_index(
-                        date=strategy_buy_date)][0]
-                    strat_price = ticker_prices["Low"].loc[get_datetime_index(
-                        date=strategy_buy_date)][0]
-                    if strat_price < open_price:
-                        # print(f"{strat_price=} < {open_price=}")
-                        return strat_price, strategy_buy_date
-                except KeyError:
-                    continue
-
-
-def main():
-    tickers = ("BTC-USD", "SOL-USD", "ETH-USD", "XRP-USD", "SPUS")
-    strategy = "Blind"
-    start_day, start_month, start_year = 15, 1, 2024
-    # end_day, end_month, end_year = 15, 1, 2024
-    amount_added = 100
-
-    session = CachedSession("yfinance.cache")
-    session.headers["User-agent"] = 'my-program/1.0'
+    aud_prices = pd.DataFrame(histories["AUD=X"])
+    if args.sweep or args.walk_forward or args.monte_carlo:
+        available = [ticker for ticker in tickers if ticker in histories]
+        for ticker in sorted(set(tickers) - set(available)):
+            print(f"Error: Could not load {ticker} prices, skipping it: {errors[ticker]}")
+        ticker_types = {ticker: get_ticker_type(ticker) for ticker in available}
+        asset_types = {ticker: ticker_type["type"] for ticker, ticker_type in ticker_types.items()}
+        ends = {ticker: datetime.now(tz=ticker_type["timezone"]).replace(tzinfo=None) if spec["end"] is None
+                else pd.Timestamp(spec["end"]).to_pydatetime() for ticker, ticker_type in ticker_types.items()}
+    if args.walk_forward:
+        from backtest_walk_forward import run_walk_forward
+
+        first_start = window_start.replace(day=start.day, hour=0, minute=0, second=0, microsecond=0)
+        if first_start < window_start:
+            first_start += relativedelta(months=1)
+        dates = args.start_dates[0] if args.start_dates else first_start.strftime("%Y-%m-%d")
+        first, _, last = dates.partition(":")
+        with span("walk_forward"):
+            results = run_walk_forward(histories, asset_types, args.strategies or [strategy], pd.Timestamp(first),
+                                       args.amounts or [amount_added], ends, withholding, reinvest, fees)
+        if last:
+            results = results[results["Start"] <= pd.Timestamp(last)]
+        print(f"{len(results)} start dates backtested, results written to "
+              f"{write_table(results, args.output or 'backtest_walk_forward.parquet')}")
+        return
+    if args.monte_carlo:
+        from backtest_monte_carlo import BLOCK_DAYS, PATHS, run_monte_carlo
+
+        if args.start_dates:
+            start = pd.Timestamp(args.start_dates[0].partition(":")[0])
+        with span("monte_carlo"):
+            results = run_monte_carlo(histories, asset_types, args.strategies or [strategy], start,
+                                      args.amounts or [amount_added], ends, args.paths or PATHS,
+                                      args.block_days or BLOCK_DAYS, args.workers, args.seed, fees)
+        print(f"{len(results)} configurations simulated on {args.paths or PATHS} paths each, results written to "
+              f"{write_table(results, args.output or 'backtest_monte_carlo.parquet')}")
+        return
+    if args.sweep:
+        from backtest_sweep import monthly_starts, run_sweep
+
+        strategies, amounts = args.strategies or [strategy], args.amounts or [amount_added]
+        starts = [first for dates in (args.start_dates or [start.strftime("%Y-%m-%d")])
+                  for first in monthly_starts(dates)]
+        # Configurations backtested on the same bars before are read back, only the rest is run.
+        # Curves are not cached for a sweep, asking for them runs everything
+        history_cache, result_cache = HistoryCache(), ResultCache()
+        versions = {ticker: (history_cache.version(ticker), history_cache.version("AUD=X")) for ticker in asset_types}
+        keys = {(ticker, name, first, amount): result_key(spec, ticker, asset_types[ticker], name, first, ends[ticker],
+                                                          amount, versions[ticker])
+                for ticker, name, first, amount in product(asset_types, strategies, starts, amounts)}
+        rows = {}
+        if not (args.recompute or args.curves):
+            cached = {config: result_cache.read(key) for config, key in keys.items()}
+            rows = {config: row for config, row in cached.items() if row is not None}
+        if rows:
+            print(f"{len(rows)} configurations read from the results cache")
+        with span("sweep"):
+            results, curves = run_sweep(histories, asset_types, strategies, starts, amounts, ends, args.workers,
+                                        withholding, reinvest, curves=args.curves is not None, fees=fees,
+                                        skip=set(rows))
+        for row in results.to_dict("records"):
+            config = (row.pop("Ticker"), row.pop("Strategy"), row.pop("Start"), row.pop("Amount"))
+            result_cache.write(keys[config], row)
+            rows[config] = row
+        result_cache.save()
+        results = pd.DataFrame([{"Ticker": ticker, "Strategy": name, "Start": first, "Amount": amount,
+                                 **rows[ticker, name, first, amount]}
+                                for ticker, name, first, amount in keys if (ticker, name, first, amount) in rows],
+                               columns=results.columns)
+        print(f"{len(results)} configurations backtested, results written to "
+              f"{write_table(results, args.output or 'backtest_sweep.parquet')}")
+        if curves is not None:
+            print(f"Equity curves written to {write_table(curves, args.curves)}")
+        return
+    curves = []
+    history_cache, result_cache = HistoryCache(), ResultCache()
     for ticker in tickers:
-        if ticker in Crypto:
-            ticker_type = {
-                "type": "Cryptocurrency",
-                "timezone": ZoneInfo(key="Etc/Greenwich"),
-                "tz_string_dst": "+00"
-
-            }
-        elif ticker in US_Shares:
-            ticker_type = {
-                "type": "US_Shares",
-                "timezone": ZoneInfo(key="America/New_York"),
-                "tz_string_dst": "-05"
-            }
-        ticker_info = yf.Ticker(ticker)
-        ticker_prices = pd.DataFrame(ticker_info.history(period="5y"))
-        aud = yf.Ticker("AUD=X")
-        aud_prices = pd.DataFrame(aud.history(period="5y"))
-        dividends = ticker_prices["Dividends"]
-        total = 0
-        total_brokerage_cost = 0
-        total_current_value = 0
-        dividend_total = 0
-        total_units = 0
-        dca_price = 0
-        prev_month_buy_day = 0
-        initial_date = datetime(year=start_year, month=start_month,
-                                day=start_day,  tzinfo=ticker_type["timezone"])
-        start_date = datetime(year=start_year, month=start_month,
-                              day=start_day,  tzinfo=ticker_type["timezone"])
+        if ticker not in histories:
+            print(f"Error: Could not load {ticker} prices, skipping it: {errors[ticker]}")
+            continue
+        ticker_type = get_ticker_type(ticker)
+        ticker_prices = pd.DataFrame(histories[ticker])
+        initial_date = datetime(year=start.year, month=start.month, day=start.day, tzinfo=ticker_type["timezone"])
         end_date = datetime.now(tz=ticker_type["timezone"])
-        if "end_day" in locals():
-            end_date = datetime(year=end_year, month=end_month,
-                                day=end_day,  tzinfo=ticker_type["timezone"])
-        day_delta = timedelta(days=1)
-        month_delta = relativedelta(months=1)
-        while start_date < end_date:
-            date_string = start_date.strftime('%Y-%m-%d')
-            utc_offset_str = get_utc_offset_str(date=start_date)
-            full_date_string = f"{date_string} 00:00:00{utc_offset_str}"
-            datetime_index = pd.DatetimeIndex(data=[full_date_string])
-            found = False
-            while not found:
-                try:
-                    # date_price = ticker_prices["Close"].loc[datetime_index][0]
-                    date_price, start_date = strategy_price(
-                        ticker_prices=ticker_prices, initial_buy_date=start_date, strategy=strategy)
-                    if ticker_type["type"] in ("US_Shares", "Cryptocurrency"):
-                        usd_aud = closest_aud_price(
-                            aud_prices=aud_prices, buy_date=start_date)
-                    else:
-                        usd_aud = 1
-                    found = True
-                    dividend_total += calc_dividends(ticker_type, total_units=total_units, dividends=dividends, buy_date=start_date,
-                                                     prev_month_buy_day=prev_month_buy_day, tz_string=utc_offset_str)
-                    prev_month_buy_day = start_date.day
-                except KeyError:
-                    start_date += day_delta
-                    date_string = start_date.strftime('%Y-%m-%d')
-                    full_date_string = f"{date_string} 00:00:00{utc_offset_str}"
-                    datetime_index = pd.DatetimeIndex(data=[full_date_string])
-
-            amount_added_minus_brokerage, brokerage_cost = calc_brokerage_cost(
-                ticker_type=ticker_type, amount_aud=amount_added, usd_aud_rate=usd_aud)
-            total += amount_added_minus_brokerage
-            total_brokerage_cost += brokerage_cost
-            units_bought = amount_added_minus_brokerage / usd_aud / date_price
-            if dca_price == 0:
-                dca_price = date_price
-            else:
-                dca_price = (dca_price * total_units + date_price *
-                             units_bought) / (total_units + units_bought)
-            total_units = total_units + units_bought
-            total_current_value = total_units * date_price * usd_aud
-            # print(f"{date_datetime}: \n\tPrice: {date_price:.2f}; Total added = ${total:.2f}; Total brokerage cost = ${total_brokerage_cost:.2f}; Total current value = ${total_current_value:.2f}; Return = {(total_current_value / total - 1) * 100:.2f}%; Total Dividend Income: {dividend_total * usd_aud:.2f}; Total Units = {total_units:.2f}; DCA = {dca_price:.2f}")
-            start_date = start_date.replace(day=start_day)
-            start_date += month_delta
-
-        found = False
-        day_delta = timedelta(days=1)
-        date_shift = end_date
+        if spec["end"] is not None:
+            end_date = pd.Timestamp(spec["end"]).to_pydatetime().replace(tzinfo=ticker_type["timezone"])
+        key = result_key(spec, ticker, ticker_type["type"], strategy, initial_date.replace(tzinfo=None),
+                         end_date.replace(tzinfo=None), amount_added,
+                         (history_cache.version(ticker), history_cache.version("AUD=X")))
+        result = None if args.recompute else result_cache.result(key)
+        if result is None:
+            with span(f"simulate {ticker}"):
+                result = run_backtest(ticker_prices, aud_prices, ticker_type["type"], initial_date.replace(tzinfo=None),
+                                      end_date.replace(tzinfo=None), amount_added, strategy, withholding=withholding,
+                                      reinvest=reinvest, fees=fees)
+            result_cache.write(key, result_row(result), result["curve"])
         print(f"{ticker=}; {strategy=}; From {initial_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
-        while not found:
-            try:
-                date_string = date_shift.strftime('%Y-%m-%d')
-                full_date_string = f"{date_string} 00:00:00{utc_offset_str}"
-                datetime_index = pd.DatetimeIndex(data=[full_date_string])
-                date_price = ticker_prices["Close"].loc[datetime_index][0]
-                if ticker_type["type"] in ("US_Shares", "Cryptocurrency"):
-                    usd_aud = closest_aud_price(
-                        aud_prices=aud_prices, buy_date=date_shift)
-                total_current_value = total_units * date_price * usd_aud
-                print(f"{end_date}: \n\tPrice: {date_price:.2f}; Total added = ${total:.2f}; Total brokerage cost = ${total_brokerage_cost:.2f}; Total current value = ${total_current_value:.2f}; Return = {(total_current_value / total - 1) * 100:.2f}%; Total Dividend Income: {dividend_total * usd_aud:.2f}; Total Units = {total_units:.2f}; DCA = {dca_price:.2f}")
-                found = True
-            except KeyError:
-                date_shift -= day_delta
+        print(f"{end_date}: \n\tPrice: {result['final_price']:.2f}; Total added = ${result['total']:.2f}; Total brokerage cost = ${result['brokerage']:.2f}; Total current value = ${result['value']:.2f}; Return = {result['return'] * 100:.2f}%; Total Dividend Income: {result['dividends']:.2f}; Total Units = {result['units']:.2f}; DCA = {result['dca_price']:.2f}")
+        print(f"\tCAGR = {result['cagr'] * 100:.2f}%; Max drawdown = {result['max_drawdown'] * 100:.2f}%; "
+              f"Volatility = {result['volatility'] * 100:.2f}%; Sharpe = {result['sharpe']:.2f}; "
+              f"IRR = {result['irr'] * 100:.2f}%")
+        curves.append(result["curve"].assign(Ticker=ticker, Strategy=strategy))
+    result_cache.save()
+    if curves:
+        print(f"Equity curves written to "
+              f"{write_table(pd.concat(curves, ignore_index=True), args.curves or 'backtest_curves.parquet')}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,137 @@
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+from checkpoint import checkpoint_path, replay_from_checkpoint
+from ledger_replay import value_holdings
+from ledger_ingest import load_ledger
+from main import chartInputs, latestCloses, ledgerTickers, openValueHistory, recordPortfolioValue, summarisePortfolio
+from report_charts import update_charts
+
+
+def portfolio_name(ledger: str) -> str:
+    """The name a portfolio's report, charts and default history go by, the ledger's file name."""
+    return os.path.splitext(os.path.basename(ledger))[0]
+
+
+def parse_portfolio(entry: str, history_dir: str) -> Tuple[str, str]:
+    """Splits a LEDGER[=HISTORY] argument, defaulting the history to <history_dir>/<ledger name>.sqlite."""
+    ledger, _, history = entry.partition("=")
+    if not history:
+        history = os.path.join(history_dir, portfolio_name(ledger) + ".sqlite")
+    return ledger, history
+
+
+def name_clashes(portfolios: List[Tuple[str, str]]) -> List[str]:
+    """Problems with portfolios whose outputs would overwrite each other's: a shared name or history file."""
+    problems, names, histories = [], {}, {}
+    for ledger, history in portfolios:
+        name, history_key = portfolio_name(ledger), os.path.abspath(history)
+        if name in names:
+            problems.append(f"{names[name]} and {ledger} are both named {name}, their reports and charts would "
+                            f"overwrite each other. Rename one of them")
+        elif history_key in histories:
+            problems.append(f"{histories[history_key]} and {ledger} share the value history {history}")
+        names.setdefault(name, ledger)
+        histories.setdefault(history_key, ledger)
+    return problems
+
+
+def evaluate_portfolio(ledger: str, history: str, stocks: pd.DataFrame, closes: pd.Series, reports_dir: str,
+                       charts_dir: Optional[str], chart_format: str) -> str:
+    """Values one portfolio against the shared closes, records its history and writes its report."""
+    holdings, realised_profit_loss = value_holdings(replay_from_checkpoint(stocks, checkpoint_path(ledger)),
+                                                    closes, closes["AUD=X"])
+    report, _, curr_port_value, perc_port_change = summarisePortfolio(holdings, realised_profit_loss)
+
+    value_history, legacy_csv = openValueHistory(history, askToCreate=False)
+    recordPortfolioValue(value_history, legacy_csv, curr_port_value["All"], perc_port_change["All"])
+    port_val_df = value_history.range()
+    value_history.close()
+
+    name = portfolio_name(ledger)
+    with open(os.path.join(reports_dir, f"{name}.txt"), "w", encoding="utf-8") as fp:
+        fp.write(report + "\n")
+    if charts_dir:
+        update_charts(os.path.join(charts_dir, name), *chartInputs(holdings, curr_port_value), port_val_df,
+                      chart_format)
+    return report
+
+
+def run_batch(portfolios: List[Tuple[str, str]], reports_dir: str, charts_dir: Optional[str] = None,
+              chart_format: str = "png", offline: bool = False, workers: Optional[int] = None) -> dict:
+    """
+    Evaluates many portfolios with one shared price fetch.
+
+    Ledgers are read up front so their tickers can be deduplicated into a single request
+    (plus AUD=X); the portfolios are then replayed and reported in parallel. A ledger that can't
+    be read only fails its own portfolio.
+    """
+    ledgers = {}
+    for ledger, _ in portfolios:
+        try:
+            ledgers[ledger] = load_ledger(ledger)
+        except Exception as e:
+            print(f"Error: Could not read {ledger}: {e!r}")
+    name_tickers = ["AUD=X"]
+    for stocks in ledgers.values():
+        name_tickers += [ticker for ticker in ledgerTickers(stocks) if ticker not in name_tickers]
+    print(f"Fetching {len(name_tickers)} unique tickers for {len(ledgers)} portfolios...")
+    closes = latestCloses(name_tickers, offline)
+
+    os.makedirs(reports_dir, exist_ok=True)
+    reports = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            ledger: executor.submit(evaluate_portfolio, ledger, history, ledgers[ledger], closes, reports_dir,
+                                    charts_dir, chart_format)
+            for ledger, history in portfolios if ledger in ledgers
+        }
+        for ledger, future in futures.items():
+            try:
+                reports[ledger] = future.result()
+            except (Exception, SystemExit) as e:
+                print(f"Error: Could not evaluate {ledger}: {e!r}")
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Evaluate many portfolio spreadsheets with a single, shared market data fetch.")
+    parser.add_argument("portfolios", nargs="+", metavar="LEDGER[=HISTORY]",
+                        help="Transaction spreadsheet, optionally with its value history file (csv or sqlite).")
+    parser.add_argument("--history-dir", default="histories",
+                        help="Where histories go for portfolios without an explicit one. (Defaults to histories)")
+    parser.add_argument("--reports-dir", default="reports",
+                        help="Directory for the per-portfolio text reports. (Defaults to reports)")
+    parser.add_argument("--charts", dest="charts_dir", default=None,
+                        help="Render each portfolio's charts into a subdirectory of this directory.")
+    parser.add_argument("--chart-format", default="png", choices=("png", "svg"))
+    parser.add_argument("--offline", action="store_true", help="Value from the latest stored closes only.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes. (Defaults to the number of CPUs)")
+    args = parser.parse_args()
+
+    logging.basicConfig(filename="portfolioTracker.log", encoding="utf-8", filemode="w",
+                        format="%(asctime)s - %(levelname)s: %(message)s", level=logging.DEBUG)
+    portfolios = [parse_portfolio(entry, args.history_dir) for entry in args.portfolios]
+    problems = name_clashes(portfolios)
+    for problem in problems:
+        print(f"Error: {problem}")
+    if problems:
+        sys.exit(1)
+    reports = run_batch(portfolios, args.reports_dir, args.charts_dir, args.chart_format, args.offline, args.workers)
+    for ledger, report in reports.items():
+        print(f"\n=== {ledger} ===")
+        print(report)
+    if len(reports) != len(portfolios):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
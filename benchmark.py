@@ -0,0 +1,459 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import profiling
+
+BENCHMARK_RESULTS_PATH = "benchmark_results.jsonl"
+BENCHMARK_TICKERS = ("CBA.AX", "VAS.AX", "AAPL", "VOO", "NVDA", "SPUS", "BTC-USD", "ETH-USD", "SOL-USD", "XRP-USD")
+# Any valid base58 public key will do, the stake accounts come from the fixture
+BENCHMARK_WALLET = "11111111111111111111111111111111"
+SLOTS_PER_EPOCH = 432_000
+SECONDS_PER_EPOCH = 2 * 24 * 60 * 60
+
+
+def synthetic_bars(index: pd.DatetimeIndex, start_price: float, rng: np.random.Generator, dividends: bool) -> pd.DataFrame:
+    """Random walk OHLC bars with volume, and a quarterly dividend of half a percent when dividends is set."""
+    close = start_price * np.exp(np.cumsum(rng.normal(0.0003, 0.02, len(index))))
+    open_ = np.concatenate(([start_price], close[:-1])) * np.exp(rng.normal(0, 0.005, len(index)))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, len(index))))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, len(index))))
+    payout = np.zeros(len(index))
+    if dividends:
+        quarter_starts = np.unique(index.to_period("Q").start_time.normalize(), return_index=True)[1]
+        payout[quarter_starts] = close[quarter_starts] * 0.005
+    return pd.DataFrame({"Open": open_, "High": high, "Low": low, "Close": close,
+                         "Volume": rng.integers(1_000, 1_000_000, len(index)).astype(float), "Dividends": payout},
+                        index=index)
+
+
+def trading_days(ticker: str, start, end, tz: str = None) -> pd.DatetimeIndex:
+    """Every day for crypto, weekdays for everything else, at midnight in tz like Yahoo's daily bars."""
+    freq = "D" if ticker.endswith("USD") else "B"
+    return pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize(), freq=freq, tz=tz)
+
+
+def synthetic_price_histories(tickers, start, end, seed: int = 0) -> dict:
+    """{ticker: daily bars} for tickers and AUD=X between start and end, naive dates."""
+    rng = np.random.default_rng(seed)
+    histories = {ticker: synthetic_bars(trading_days(ticker, start, end), rng.uniform(20, 400), rng,
+                                        dividends=not ticker.endswith("USD"))
+                 for ticker in tickers}
+    aud = synthetic_bars(trading_days("AUD=X", start, end), 1.45, rng, dividends=False)
+    aud[["Open", "High", "Low", "Close"]] = 1.45 + (aud[["Open", "High", "Low", "Close"]] - 1.45) * 0.05
+    histories["AUD=X"] = aud
+    return histories
+
+
+def synthetic_ledger(rows: int, histories: dict, seed: int = 0) -> pd.DataFrame:
+    """
+    A valid transaction sheet of rows rows over the tickers of histories, priced off their closes.
+
+    Sells only ever take part of a holding so the units can never be oversold after a round trip
+    through a spreadsheet.
+    """
+    rng = np.random.default_rng(seed)
+    tickers = [ticker for ticker in histories if ticker != "AUD=X"]
+    aud = histories["AUD=X"]["Close"]
+    start, end = aud.index[0], aud.index[-1]
+    dates = np.sort(rng.choice(pd.date_range(start, end, freq="D"), rows))
+    held = {}
+    records = []
+    for date in pd.DatetimeIndex(dates):
+        ticker = tickers[rng.integers(len(tickers))]
+        closes = histories[ticker]["Close"]
+        price = round(float(closes.asof(date) if date >= closes.index[0] else closes.iloc[0]), 2)
+        rate = 1.0 if ticker.endswith("AX") else round(float(aud.asof(date)), 4)
+        action = "BUY" if ticker not in held else rng.choice(["BUY", "SELL", "TRANSACTION", "DIVIDEND", "DIVIDEND-FIAT"],
+                                                             p=[0.5, 0.2, 0.05, 0.1, 0.15])
+        units = round(float(rng.uniform(0.5, 20)), 3)
+        if action in ("SELL", "TRANSACTION"):
+            units = np.floor(held[ticker] * rng.uniform(0.1, 0.5) * 1000) / 1000
+            if units <= 0:
+                action, units = "BUY", 1.0
+        if action == "DIVIDEND-FIAT":
+            records.append((date, ticker, action, np.nan, round(price * 0.01, 2), np.nan, "", rate))
+            continue
+        held[ticker] = held.get(ticker, 0.0) + (-units if action in ("SELL", "TRANSACTION") else units)
+        records.append((date, ticker, action, units, price if action != "DIVIDEND" else np.nan, np.nan, "", rate))
+    return pd.DataFrame(records, columns=["Date", "Ticker", "Action", "Units", "Price", "Fee", "Notes", "AUD Rate"])
+
+
+def synthetic_cpi_table(path: str, start="2000-01-01"):
+    """Quarterly CPI through the next quarter so the tracker never asks ausdex for a newer one."""
+    quarters = pd.date_range(start, pd.Timestamp.today() + pd.DateOffset(months=6), freq="QS-MAR")
+    cpi = pd.Series(np.linspace(70, 140, len(quarters)), index=quarters, name="CPI").rename_axis("Quarter")
+    cpi.to_csv(path)
+
+
+def write_portfolio_fixture(directory: str, rows: int, tickers, years: float, seed: int, ledger_format: str) -> str:
+    """Writes a ledger, its price store, a CPI table and an empty value history into directory."""
+    from price_store import PriceStore
+
+    end = pd.Timestamp.today().normalize()
+    histories = synthetic_price_histories(tickers, end - pd.DateOffset(days=int(years * 365)), end, seed)
+    ledger = synthetic_ledger(rows, histories, seed)
+    ledger_path = os.path.join(directory, f"ledger.{ledger_format}")
+    if ledger_format == "csv":
+        ledger.assign(Date=ledger["Date"].dt.strftime("%d/%m/%Y")).to_csv(ledger_path, index=False)
+    else:
+        ledger.to_excel(ledger_path, index=False)
+
+    store = PriceStore(os.path.join(directory, "prices.sqlite"))
+    bars = pd.concat({ticker: history.drop(columns="Dividends") for ticker, history in histories.items()}, axis=1)
+    store.write(bars.swaplevel(axis=1), datetime.now())
+    store.close()
+    synthetic_cpi_table(os.path.join(directory, "cpi_brisbane.csv"))
+    with open(os.path.join(directory, "history.csv"), "w") as fp:
+        fp.write("Date,Value,Percentage\n")
+    return ledger_path
+
+
+class FixtureTicker:
+    """Stands in for yf.Ticker, serving the synthetic histories with Yahoo's exchange time zones."""
+    time_zones = {"AUD=X": "Europe/London"}
+
+    def __init__(self, histories: dict, ticker: str):
+        self.history_frame = histories[ticker].copy()
+        tz = self.time_zones.get(ticker, "UTC" if ticker.endswith("USD") else "America/New_York")
+        self.history_frame.index = self.history_frame.index.tz_localize(tz)
+
+    def history(self, start=None, **kwargs) -> pd.DataFrame:
+        if start is None:
+            return self.history_frame
+        return self.history_frame[self.history_frame.index >= pd.Timestamp(start, tz=self.history_frame.index.tz)]
+
+
+class FixtureRpcClient:
+    """Canned Solana RPC responses for get_staking_rewards: stake accounts, epochs, rewards and block times."""
+
+    def __init__(self, accounts: int, current_epoch: int, seed: int):
+        self.accounts = [f"Stake{index:039d}" for index in range(accounts)]
+        self.current_epoch = current_epoch
+        self.rng = np.random.default_rng(seed)
+        self.genesis = int(datetime(2020, 3, 16).timestamp())
+
+    def __call__(self, rpc_url, commitment=None):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def is_connected(self):
+        return True
+
+    async def get_program_accounts(self, program_id, commitment=None, encoding=None, filters=None):
+        return SimpleNamespace(value=[SimpleNamespace(pubkey=account) for account in self.accounts])
+
+    async def get_epoch_info(self, commitment=None):
+        return SimpleNamespace(value=SimpleNamespace(epoch=self.current_epoch))
+
+    async def get_inflation_reward(self, pubkeys, epoch, commitment=None):
+        rewards = [SimpleNamespace(amount=int(self.rng.integers(1_000_000, 50_000_000)),
+                                   effective_slot=epoch * SLOTS_PER_EPOCH + 1) for _ in pubkeys]
+        return SimpleNamespace(value=rewards)
+
+    async def get_block_time(self, slot):
+        return SimpleNamespace(value=self.genesis + slot // SLOTS_PER_EPOCH * SECONDS_PER_EPOCH)
+
+
+def fixture_coingecko_get(url, timeout=None):
+    """Canned CoinGecko history response, the rate is derived from the requested date."""
+    date = url.rsplit("=", 1)[1]
+    day = datetime.strptime(date, "%d-%m-%Y").toordinal()
+    payload = {"market_data": {"current_price": {"aud": 50 + day % 200}}}
+    return SimpleNamespace(raise_for_status=lambda: None, json=lambda: payload)
+
+
+def fixture_chart_payload(symbol: str, bars: pd.DataFrame) -> dict:
+    """bars in the JSON shape of Yahoo's chart endpoint, with UTC midnight timestamps."""
+    timestamps = (bars.index.tz_localize("UTC").asi8 // 10**9).tolist()
+    quote = {field.lower(): bars[field].round(4).tolist() for field in ("Open", "High", "Low", "Close", "Volume")}
+    paid = bars["Dividends"] > 0
+    dividends = {str(ts): {"amount": amount, "date": ts}
+                 for ts, amount in zip(np.array(timestamps)[paid.to_numpy()].tolist(), bars["Dividends"][paid].tolist())}
+    return {"chart": {"result": [{"meta": {"symbol": symbol, "exchangeTimezoneName": "UTC"}, "timestamp": timestamps,
+                                  "events": {"dividends": dividends}, "indicators": {"quote": [quote]}}],
+                      "error": None}}
+
+
+class FixtureChartHandler(BaseHTTPRequestHandler):
+    """
+    Local stand-in for Yahoo's chart endpoint. Answers after latency seconds, and the flaky symbols
+    get a 503 on their first request so the fetcher's retries are part of the timing.
+    """
+    payloads = {}
+    latency = 0.0
+    flaky = set()
+    failed = set()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        symbol = self.path.split("?")[0].rsplit("/", 1)[-1]
+        time.sleep(self.latency)
+        with self.lock:
+            fail = symbol in self.flaky and symbol not in self.failed
+            self.failed.add(symbol)
+        if symbol not in self.payloads or fail:
+            self.send_response(404 if symbol not in self.payloads else 503)
+            self.end_headers()
+            return
+        body = self.payloads[symbol]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_chart_server(histories: dict, latency: float, flaky_every: int = 25) -> ThreadingHTTPServer:
+    """Serves histories on a free local port from a daemon thread."""
+    FixtureChartHandler.payloads = {symbol: json.dumps(fixture_chart_payload(symbol, bars)).encode()
+                                    for symbol, bars in histories.items()}
+    FixtureChartHandler.latency = latency
+    FixtureChartHandler.flaky = set(list(histories)[::flaky_every])
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureChartHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _timed_runs(run, repeat: int, setup=None) -> list:
+    """Wall time of repeat calls to run, each after its own untimed setup, with output discarded."""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        # Background chart workers must not overlap the next run
+        for child in multiprocessing.active_children():
+            child.join()
+    return timings
+
+
+def benchmark_main(fixture_dir: str, ledger_path: str, repeat: int) -> dict:
+    """Times main.main cold (no checkpoint or ledger cache yet), warm, and with a full history backfill."""
+    import main
+
+    work_dir = os.path.join(fixture_dir, "run")
+    argv = ["-i", os.path.basename(ledger_path), "-o", "history.csv", "--offline", "--charts", "charts"]
+
+    def fresh_copy():
+        shutil.rmtree(work_dir, ignore_errors=True)
+        shutil.copytree(fixture_dir, work_dir, ignore=shutil.ignore_patterns("run"))
+        os.chdir(work_dir)
+
+    cases = {"main cold": _timed_runs(lambda: main.main(argv), repeat, setup=fresh_copy)}
+    cases["main warm"] = _timed_runs(lambda: main.main(argv), repeat)
+    cases["main backfill"] = _timed_runs(lambda: main.main(argv + ["--backfill"]), repeat)
+    return cases
+
+
+def benchmark_backtester(histories: dict, work_dir: str, repeat: int) -> dict:
+    """Times backtester.main as configured and sweeping a grid, with yf.Ticker serving the synthetic histories."""
+    import backtester
+
+    os.chdir(work_dir)
+    with mock.patch("yfinance.Ticker", lambda ticker: FixtureTicker(histories, ticker)):
+        sweep = ["--sweep", "--strategies", "Blind", "Red Day", "Red Low", "Red Day-5", "Red Day-10",
+                 "--start-dates", "2023-01-15:2023-12-15", "--amounts", "50", "100", "200", "500"]
+        return {"backtester": _timed_runs(lambda: backtester.main([]), repeat),
+                "backtester sweep 1200": _timed_runs(lambda: backtester.main(sweep), repeat)}
+
+
+def benchmark_dca_engine(tickers: int, years: float, seed: int, repeat: int) -> dict:
+    """Times run_backtest over tickers synthetic tickers, monthly buys across the whole history."""
+    from dca_engine import run_backtest
+
+    end = pd.Timestamp.today()
+    symbols = [f"SYM{index:02d}" + ("-USD" if index % 2 else "") for index in range(tickers)]
+    histories = synthetic_price_histories(symbols, end - pd.DateOffset(years=years), end, seed)
+    start = end - pd.DateOffset(years=years) + pd.DateOffset(days=1)
+
+    def run_all():
+        for symbol in symbols:
+            run_backtest(histories[symbol], histories["AUD=X"], "Cryptocurrency" if symbol.endswith("USD") else
+                         "US_Shares", start, end, 100)
+
+    return {f"dca engine {tickers} tickers": _timed_runs(run_all, repeat)}
+
+
+def benchmark_staking(work_dir: str, epochs: int, accounts: int, seed: int, repeat: int) -> dict:
+    """Times get_staking_rewards against canned RPC and CoinGecko responses, without the rate limit delay."""
+    try:
+        import solana_staking_reward_tracker as tracker
+    except ImportError as e:
+        print(f"Skipping the staking benchmark, its dependencies are not installed: {e}")
+        return {}
+
+    os.chdir(work_dir)
+    os.makedirs("results", exist_ok=True)
+
+    def fresh_rewards():
+        with open("staking_rewards.yaml", "w") as fp:
+            fp.write("{}\n")
+
+    client = FixtureRpcClient(accounts, current_epoch=700, seed=seed)
+    run = lambda: asyncio.run(tracker.get_staking_rewards(BENCHMARK_WALLET, "http://fixture", epochs))
+    with mock.patch.object(tracker, "AsyncClient", client), mock.patch.object(tracker, "COINGECKO_API_DELAY", 0), \
+            mock.patch.object(tracker.requests, "get", fixture_coingecko_get):
+        return {"staking": _timed_runs(run, repeat, setup=fresh_rewards)}
+
+
+def benchmark_fetcher(symbols: int, latency: float, seed: int, repeat: int) -> dict:
+    """Times refreshing symbols tickers from a local chart server, on the default pool and on a single worker."""
+    from market_data import Fetcher, YahooChartProvider
+
+    end = pd.Timestamp.today()
+    histories = synthetic_price_histories([f"SYM{index:03d}" for index in range(symbols)], end - pd.DateOffset(years=1),
+                                          end, seed)
+    server = start_chart_server(histories, latency)
+    provider = YahooChartProvider(f"http://127.0.0.1:{server.server_address[1]}")
+
+    def fetch_all(max_workers=None):
+        FixtureChartHandler.failed = set()
+        fetcher = Fetcher(provider, backoff=0.01) if max_workers is None else \
+            Fetcher(provider, max_workers=max_workers, backoff=0.01)
+        results = fetcher.fetch_many(list(histories))
+        if len(results) != len(histories):
+            raise RuntimeError(f"Fetched {len(results)} of {len(histories)} symbols: {fetcher.errors}")
+
+    try:
+        return {f"fetch {symbols}": _timed_runs(fetch_all, repeat),
+                f"fetch {symbols} serial": _timed_runs(lambda: fetch_all(max_workers=1), 1)}
+    finally:
+        server.shutdown()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_result(results_path: str, config: dict):
+    """The last stored run with the same configuration, or None."""
+    if not os.path.exists(results_path):
+        return None
+    previous = None
+    with open(results_path) as fp:
+        for line in fp:
+            result = json.loads(line)
+            if result.get("config") == config:
+                previous = result
+    return previous
+
+
+def run_benchmarks(rows: int, tickers: int, years: float, epochs: int, accounts: int, seed: int, repeat: int,
+                   ledger_format: str, suites, symbols: int = 200, latency: float = 0.02) -> dict:
+    """Builds the fixtures in a temporary directory and runs the selected suites against them."""
+    config = {"rows": rows, "tickers": tickers, "years": years, "epochs": epochs, "accounts": accounts, "seed": seed,
+              "repeat": repeat, "ledger_format": ledger_format, "suites": sorted(suites), "symbols": symbols,
+              "latency": latency}
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    original_dir = os.getcwd()
+    profiler = profiling.enable("benchmark")
+    timings = {}
+    with tempfile.TemporaryDirectory(prefix="portfolio-benchmark-") as fixture_dir:
+        try:
+            if "main" in suites:
+                ledger_path = write_portfolio_fixture(fixture_dir, rows, BENCHMARK_TICKERS[:tickers], years, seed,
+                                                      ledger_format)
+                timings.update(benchmark_main(fixture_dir, ledger_path, repeat))
+            if "backtester" in suites:
+                backtest_dir = os.path.join(fixture_dir, "backtester")
+                os.makedirs(backtest_dir)
+                end = pd.Timestamp.today()
+                timings.update(benchmark_backtester(
+                    synthetic_price_histories(("BTC-USD", "SOL-USD", "ETH-USD", "XRP-USD", "SPUS"),
+                                              end - pd.DateOffset(years=5), end, seed), backtest_dir, repeat))
+                timings.update(benchmark_dca_engine(20, 5, seed, repeat))
+            if "staking" in suites:
+                staking_dir = os.path.join(fixture_dir, "staking")
+                os.makedirs(staking_dir)
+                timings.update(benchmark_staking(staking_dir, epochs, accounts, seed, repeat))
+            if "fetcher" in suites:
+                timings.update(benchmark_fetcher(symbols, latency, seed, repeat))
+        finally:
+            os.chdir(original_dir)
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "config": config,
+        "cases": {name: {"runs": runs, "min_seconds": min(runs), "median_seconds": statistics.median(runs)}
+                  for name, runs in timings.items()},
+        "spans": profiler.report()["spans"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the tracker, backtester, staking tool and market data fetcher against synthetic data, with no "
+                    "network access.")
+    parser.add_argument("--rows", type=int, default=5000, help="Ledger rows. (Defaults to 5000)")
+    parser.add_argument("--tickers", type=int, default=8, choices=range(1, len(BENCHMARK_TICKERS) + 1),
+                        metavar=f"1-{len(BENCHMARK_TICKERS)}", help="Distinct ledger tickers. (Defaults to 8)")
+    parser.add_argument("--years", type=float, default=5, help="Years of price history and ledger. (Defaults to 5)")
+    parser.add_argument("--epochs", type=int, default=100, help="Staking epochs to check. (Defaults to 100)")
+    parser.add_argument("--accounts", type=int, default=3, help="Stake accounts in the RPC fixture. (Defaults to 3)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case. (Defaults to 3)")
+    parser.add_argument("--ledger-format", default="xlsx", choices=("xlsx", "csv"))
+    parser.add_argument("--symbols", type=int, default=200, help="Symbols the fetcher refreshes. (Defaults to 200)")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="Seconds the local chart server takes per request. (Defaults to 0.02)")
+    parser.add_argument("--suites", nargs="+", default=["main", "backtester", "staking", "fetcher"],
+                        choices=("main", "backtester", "staking", "fetcher"))
+    parser.add_argument("--results", default=BENCHMARK_RESULTS_PATH,
+                        help=f"JSON lines file the run is appended to. (Defaults to {BENCHMARK_RESULTS_PATH})")
+    args = parser.parse_args()
+
+    result = run_benchmarks(args.rows, args.tickers, args.years, args.epochs, args.accounts, args.seed, args.repeat,
+                            args.ledger_format, set(args.suites), args.symbols, args.latency)
+    previous = previous_result(args.results, result["config"])
+    print(f"{'case':<24}{'median (s)':>12}{'min (s)':>12}  {'vs previous'}")
+    for name, stats in result["cases"].items():
+        change = ""
+        if previous and name in previous["cases"]:
+            before = previous["cases"][name]["median_seconds"]
+            change = f"{(stats['median_seconds'] / before - 1) * 100:+.1f}% ({previous['commit']})"
+        print(f"{name:<24}{stats['median_seconds']:>12.3f}{stats['min_seconds']:>12.3f}  {change}")
+    with open(args.results, "a") as fp:
+        fp.write(json.dumps(result) + "\n")
+    print(f"Results appended to {args.results}")
+
+
+if __name__ == '__main__':
+    main()
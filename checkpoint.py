@@ -0,0 +1,70 @@
+import hashlib
+import json
+import logging
+import os
+import pandas as pd
+from ledger_ingest import ledger_key
+from ledger_replay import replay_ledger
+
+CHECKPOINT_DIR = "checkpoints"
+
+
+def checkpoint_path(portfolioDir: str) -> str:
+    """One checkpoint per ledger, named after the spreadsheet and a hash of its absolute path."""
+    return os.path.join(CHECKPOINT_DIR, ledger_key(portfolioDir) + ".json")
+
+
+def ledger_hash(stocks: pd.DataFrame, rows: int) -> str:
+    """Hashes the first rows of the ledger so edits to already replayed rows can be detected."""
+    row_hashes = pd.util.hash_pandas_object(stocks.iloc[:rows].astype(str), index=False).to_numpy()
+    return hashlib.sha256(row_hashes.tobytes()).hexdigest()
+
+
+def load_checkpoint(path: str):
+    """Returns (rows replayed, ledger prefix hash, state) or None when there is no usable checkpoint."""
+    try:
+        with open(path) as fp:
+            checkpoint = json.load(fp)
+        state = pd.DataFrame(**checkpoint["state"])
+        state.index.name = "Ticker"
+        return checkpoint["rows"], checkpoint["ledger_hash"], state
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        logging.warning("Ignoring unreadable checkpoint %s: %s", path, e)
+        return None
+
+
+def save_checkpoint(path: str, stocks: pd.DataFrame, state: pd.DataFrame):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    checkpoint = {
+        "rows": len(stocks),
+        "ledger_hash": ledger_hash(stocks, len(stocks)),
+        "state": state.to_dict(orient="split"),
+    }
+    # Write then rename so an interrupted run never leaves a half written checkpoint behind
+    with open(path + ".tmp", "w") as fp:
+        json.dump(checkpoint, fp)
+    os.replace(path + ".tmp", path)
+
+
+def replay_from_checkpoint(stocks: pd.DataFrame, path: str) -> pd.DataFrame:
+    """
+    Replays only the ledger rows appended since the checkpoint at path and saves a new one.
+
+    Falls back to a full replay when the checkpoint is missing or any row it covered was edited.
+    """
+    checkpoint = load_checkpoint(path)
+    if checkpoint is not None:
+        rows, prefix_hash, initial = checkpoint
+        if rows <= len(stocks) and ledger_hash(stocks, rows) == prefix_hash:
+            logging.info("Replaying %d new ledger rows on top of the checkpoint of %d rows", len(stocks) - rows, rows)
+            if rows == len(stocks):
+                return initial
+            state = replay_ledger(stocks.iloc[rows:], initial=initial)
+            save_checkpoint(path, stocks, state)
+            return state
+        logging.info("Ledger rows covered by %s were edited, replaying the whole ledger", path)
+    state = replay_ledger(stocks)
+    save_checkpoint(path, stocks, state)
+    return state
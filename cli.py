@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Nothing heavy is imported at module level: each command imports its own stack once it is chosen.
+COMMANDS = ("portfolio", "backtest", "staking")
+# Modules a command must never pull in while it starts up, on top of what every command forbids
+FORBIDDEN_MODULES = {
+    None: ("pandas", "numpy", "yfinance", "matplotlib", "solana", "solders", "ausdex", "openpyxl"),
+    "portfolio": ("yfinance", "matplotlib", "solana", "solders", "ausdex", "openpyxl"),
+    "backtest": ("yfinance", "matplotlib", "solana", "solders", "ausdex"),
+    "staking": ("pandas", "yfinance", "matplotlib", "ausdex"),
+}
+# Seconds each command may take to import, generous so only real regressions fail the check
+STARTUP_BUDGETS = {None: 0.3, "portfolio": 2.0, "backtest": 2.0, "staking": 2.0}
+STARTUP_RUNS = 3
+
+
+def load_command(name: str):
+    """Imports a command's module and returns its entry point, a function of the command's argv."""
+    if name == "portfolio":
+        from main import main
+        return main
+    if name == "backtest":
+        from backtester import main
+        return main
+    if name == "staking":
+        import asyncio
+        from solana_staking_reward_tracker import main as staking_main
+        return lambda argv: asyncio.run(staking_main(argv))
+    raise ValueError(f"Unknown command {name}")
+
+
+def measure_startup(command: str = None) -> dict:
+    """Imports the CLI, and command if given, in a fresh interpreter. Returns the seconds taken and the modules loaded."""
+    probe = ("import json, sys, time\n"
+             "start = time.perf_counter()\n"
+             "import cli\n"
+             f"command = {command!r}\n"
+             "if command:\n"
+             "    cli.load_command(command)\n"
+             "print(json.dumps({'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}))\n")
+    completed = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def check_startup(runs: int = STARTUP_RUNS) -> list:
+    """Returns the startup regressions: commands over their time budget or importing a forbidden module."""
+    problems = []
+    for command in (None,) + COMMANDS:
+        label = command or "cli"
+        try:
+            samples = [measure_startup(command) for _ in range(runs)]
+        except subprocess.CalledProcessError as e:
+            print(f"{label:<10} could not be imported, skipped: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        seconds = statistics.median(sample["seconds"] for sample in samples)
+        loaded = {module.split(".")[0] for module in samples[0]["modules"]}
+        forbidden = sorted(set(FORBIDDEN_MODULES[None] if command is None else FORBIDDEN_MODULES[command]) & loaded)
+        print(f"{label:<10} {seconds:6.3f}s (budget {STARTUP_BUDGETS[command]:.1f}s)"
+              + (f", imports {', '.join(forbidden)}" if forbidden else ""))
+        if seconds > STARTUP_BUDGETS[command]:
+            problems.append(f"{label} took {seconds:.3f}s to start, the budget is {STARTUP_BUDGETS[command]}s")
+        if forbidden:
+            problems.append(f"{label} imports {', '.join(forbidden)} at startup")
+    return problems
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Portfolio tracker, DCA backtester and Solana staking reward tracker.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    portfolio = commands.add_parser("portfolio", help="Value a portfolio spreadsheet and record its history.")
+    portfolio.add_argument("-i", "--ifile", required=True, help="Transaction spreadsheet (xlsx, csv or parquet).")
+    portfolio.add_argument("-o", "--ofile", required=True, help="Portfolio value history (csv or sqlite).")
+    portfolio.add_argument("--offline", action="store_true", help="Value from the latest stored closes only.")
+    portfolio.add_argument("--charts", help="Render the charts headless into this directory instead of showing them.")
+    portfolio.add_argument("--chart-format", choices=("png", "svg"))
+    portfolio.add_argument("--lots", choices=("fifo", "lifo", "specific"), help="Report realised gains per lot.")
+    portfolio.add_argument("--lot-selection", help="Specific identification csv with Sell Row and Lot Row columns.")
+    portfolio.add_argument("--backfill", action="store_true", help="Rebuild every day of the value history.")
+    portfolio.add_argument("--profile", metavar="JSON", help="Write named timing spans for this run to a JSON file.")
+
+    # The backtester owns its options and their help, everything after the command name is passed to it as is
+    commands.add_parser("backtest", add_help=False,
+                        help="Backtest monthly dollar cost averaging into a set of tickers.")
+
+    staking = commands.add_parser("staking", help="Retrieve Solana native staking rewards with historical AUD values.")
+    staking.add_argument("wallet_address", help="Your Solana wallet public key.")
+    staking.add_argument("--rpc_url", help="Solana RPC endpoint URL. (Defaults to mainnet-beta)")
+    staking.add_argument("--epochs", type=int, help="Number of recent epochs to check for rewards.")
+    staking.add_argument("--profile", metavar="JSON", help="Write named timing spans for this run to a JSON file.")
+
+    startup = commands.add_parser("startup-check", help="Fail when a command starts slower or imports more than it should.")
+    startup.add_argument("--runs", type=int, default=STARTUP_RUNS, help="Fresh interpreters per command.")
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # Validates the arguments (and answers -h) before anything heavy is imported, bar the backtester's own
+    parser = build_parser()
+    args, unknown = parser.parse_known_args(argv)
+    if unknown and args.command != "backtest":
+        parser.error(f"unrecognized arguments: {' '.join(unknown)}")
+    if args.command == "startup-check":
+        problems = check_startup(args.runs)
+        for problem in problems:
+            print(f"Error: {problem}")
+        sys.exit(1 if problems else 0)
+    # The command parses its own arguments again, everything after the command name is passed through
+    command_args = argv[argv.index(args.command) + 1:]
+    return load_command(args.command)(command_args)
+
+
+if __name__ == '__main__':
+    main()
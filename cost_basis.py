@@ -0,0 +1,197 @@
+import logging
+import os
+import sys
+from collections import deque
+import numpy as np
+import pandas as pd
+
+LOT_METHODS = ("fifo", "lifo", "specific")
+LOTS_DIR = "lots"
+# Lots with fewer units left than this are treated as used up, it absorbs float error from partial sells
+LOT_TOLERANCE = 1e-10
+# Spreadsheet row of the first ledger row, the header takes row 1
+FIRST_LEDGER_ROW = 2
+# Assets held this long before disposal qualify for the CGT discount
+CGT_DISCOUNT_DAYS = 365
+
+
+class FxTable:
+    """USD to AUD rates by date. Lookups binary search the sorted dates and take the last rate on or before."""
+
+    def __init__(self, rates: pd.Series):
+        rates = rates.dropna()
+        rates.index = pd.to_datetime(rates.index).normalize()
+        rates = rates[~rates.index.duplicated(keep="last")].sort_index()
+        self.dates = rates.index.to_numpy(dtype="datetime64[ns]")
+        self.rates = rates.to_numpy(dtype=float)
+
+    def __len__(self):
+        return len(self.rates)
+
+    def as_series(self) -> pd.Series:
+        return pd.Series(self.rates, index=pd.DatetimeIndex(self.dates))
+
+    def rate_at(self, dates) -> np.ndarray:
+        """Rates as of dates. Dates before the first known rate get the first rate, NaN when the table is empty."""
+        dates = pd.to_datetime(pd.Series(dates)).dt.normalize().to_numpy(dtype="datetime64[ns]")
+        if not len(self.rates):
+            return np.full(len(dates), np.nan)
+        positions = np.searchsorted(self.dates, dates, side="right") - 1
+        return self.rates[np.clip(positions, 0, None)]
+
+
+def fx_table(stocks: pd.DataFrame, stored_rates: pd.Series = None) -> FxTable:
+    """
+    Builds the FX table from the rates recorded on non-AUS ledger rows (column H), which are what
+    the broker actually charged, filled in with stored AUD=X closes on days without a trade.
+    """
+    rate = pd.to_numeric(stocks[stocks.columns[7]], errors="coerce")
+    foreign = ~stocks["Ticker"].astype(str).str.endswith("AX") & rate.notna()
+    ledger_rates = pd.Series(rate[foreign].to_numpy(), index=pd.to_datetime(stocks.loc[foreign, "Date"]).dt.normalize())
+    ledger_rates = ledger_rates.groupby(level=0).last()
+    if stored_rates is not None and len(stored_rates):
+        stored_rates = stored_rates.copy()
+        stored_rates.index = pd.to_datetime(stored_rates.index).normalize()
+        ledger_rates = ledger_rates.combine_first(stored_rates)
+    return FxTable(ledger_rates)
+
+
+def read_lot_selection(path: str) -> dict:
+    """
+    Reads a specific identification csv with "Sell Row" and "Lot Row" columns, both spreadsheet row
+    numbers, one line per lot in the order they are drawn on. Returns {sell position: [lot positions]}.
+    """
+    selection = pd.read_csv(path)
+    selection = selection[["Sell Row", "Lot Row"]].astype(int) - FIRST_LEDGER_ROW
+    return selection.groupby("Sell Row", sort=False)["Lot Row"].agg(list).to_dict()
+
+
+def match_lots(stocks: pd.DataFrame, method: str = "fifo", fx: FxTable = None, lot_selection: dict = None):
+    """
+    Replays the ledger as lots: every BUY or DIVIDEND row opens one, and SELL and TRANSACTION rows
+    draw them down in FIFO or LIFO order, or from the lots named in lot_selection for "specific".
+    A sale without a selection, or with too few units selected, is drawn FIFO for the remainder.
+
+    Each ticker keeps a queue of its open lots, so a sale only touches the lots it uses up. Dividend
+    lots carry no cost, matching the replay which does not count them in the initial value.
+
+    Returns (realised, open_lots): one row per lot drawn on by each disposal with its AUD cost,
+    proceeds and gain, and one row per lot still held. Proceeds use the rate recorded on the sale
+    row, or the FX table as of the sale date when the row has none.
+    """
+    if method not in LOT_METHODS:
+        raise ValueError(f"Lot method must be one of {LOT_METHODS}, got {method}")
+    lot_selection = lot_selection or {}
+    fx = fx if fx is not None else fx_table(stocks)
+
+    stocks = stocks.reset_index(drop=True)
+    dates = pd.to_datetime(stocks["Date"]).tolist()
+    tickers = stocks["Ticker"].tolist()
+    actions = stocks["Action"].tolist()
+    units = pd.to_numeric(stocks["Units"], errors="coerce").tolist()
+    prices = pd.to_numeric(stocks["Price"], errors="coerce").tolist()
+    rates = pd.to_numeric(stocks[stocks.columns[7]], errors="coerce").tolist()
+
+    # Lots as parallel lists indexed by lot number, the queues hold lot numbers
+    lot_row, lot_remaining, lot_price, lot_rate = [], [], [], []
+    lot_of_row = {}
+    queues = {}
+    held = {}
+    realised = []
+
+    def draw(ticker, row, lot, take):
+        lot_remaining[lot] -= take
+        realised.append((ticker, row, lot_row[lot], dates[lot_row[lot]], dates[row], actions[row], take,
+                         lot_price[lot], lot_rate[lot], prices[row] if actions[row] == "SELL" else np.nan,
+                         rates[row]))
+
+    for row, (ticker, action) in enumerate(zip(tickers, actions)):
+        if action in ("BUY", "DIVIDEND"):
+            lot_of_row[row] = len(lot_row)
+            queues.setdefault(ticker, deque()).append(len(lot_row))
+            lot_row.append(row)
+            lot_remaining.append(units[row])
+            lot_price.append(prices[row] if action == "BUY" else 0.0)
+            lot_rate.append(rates[row])
+            held[ticker] = held.get(ticker, 0) + units[row]
+        elif action in ("SELL", "TRANSACTION"):
+            if ticker not in queues:
+                print(f"{ticker} has not been bought prior to the sell event, please review the portfolio "
+                      f"spreadsheet")
+                sys.exit()
+            if held[ticker] < units[row]:
+                print(f"Error: Units sold for {ticker} cannot be greater than units pre-existing in portfolio. "
+                      f"Please update the portfolio spreadsheet with corrected units")
+                sys.exit()
+            held[ticker] -= units[row]
+            left = units[row]
+            if method == "specific":
+                for selected in lot_selection.get(row, ()):
+                    lot = lot_of_row.get(selected)
+                    if lot is None or tickers[selected] != ticker or selected > row:
+                        print(f"Error: Row {selected + FIRST_LEDGER_ROW} is not an earlier {ticker} lot, it cannot be "
+                              f"sold by row {row + FIRST_LEDGER_ROW}. Please review the lot selection")
+                        sys.exit()
+                    take = min(left, lot_remaining[lot])
+                    if take > LOT_TOLERANCE:
+                        draw(ticker, row, lot, take)
+                        left -= take
+                    if left <= LOT_TOLERANCE:
+                        break
+                if left > LOT_TOLERANCE and row in lot_selection:
+                    logging.info("Lot selection for row %d covers too few units, drawing the rest FIFO",
+                                 row + FIRST_LEDGER_ROW)
+            queue = queues[ticker]
+            from_end = method == "lifo"
+            while left > LOT_TOLERANCE and queue:
+                lot = queue[-1] if from_end else queue[0]
+                if lot_remaining[lot] <= LOT_TOLERANCE:
+                    # Used up, possibly by a specific identification, so it leaves the queue lazily
+                    queue.pop() if from_end else queue.popleft()
+                    continue
+                take = min(left, lot_remaining[lot])
+                draw(ticker, row, lot, take)
+                left -= take
+
+    realised = pd.DataFrame(realised, columns=["Ticker", "sell_row", "lot_row", "buy_date", "sell_date", "action",
+                                               "units", "cost_price", "buy_AUD_exchange_rate", "sale_price",
+                                               "sale_AUD_exchange_rate"])
+    lots = pd.DataFrame({"Ticker": [tickers[row] for row in lot_row], "lot_row": lot_row,
+                         "buy_date": [dates[row] for row in lot_row], "units": lot_remaining, "cost_price": lot_price,
+                         "buy_AUD_exchange_rate": lot_rate})
+    open_lots = lots[lots["units"] > LOT_TOLERANCE].reset_index(drop=True)
+
+    for frame in (realised, open_lots):
+        _fill_exchange_rates(frame, "buy_date", "buy_AUD_exchange_rate", fx)
+        frame["cost_AUD"] = frame["units"] * frame["cost_price"] * frame["buy_AUD_exchange_rate"]
+    _fill_exchange_rates(realised, "sell_date", "sale_AUD_exchange_rate", fx)
+    realised["proceeds_AUD"] = realised["units"] * realised["sale_price"] * realised["sale_AUD_exchange_rate"]
+    realised["gain_AUD"] = realised["proceeds_AUD"] - realised["cost_AUD"]
+    realised["held_days"] = (realised["sell_date"] - realised["buy_date"]).dt.days
+    realised["cgt_discount"] = realised["held_days"] > CGT_DISCOUNT_DAYS
+    # Report rows as the spreadsheet numbers them
+    realised[["sell_row", "lot_row"]] += FIRST_LEDGER_ROW
+    open_lots["lot_row"] += FIRST_LEDGER_ROW
+    return realised, open_lots
+
+
+def _fill_exchange_rates(frame: pd.DataFrame, date_column: str, rate_column: str, fx: FxTable):
+    """AUS tickers trade in AUD, other rows missing a recorded rate take the FX table's rate for their date."""
+    aus = frame["Ticker"].astype(str).str.endswith("AX").to_numpy()
+    rate = frame[rate_column].to_numpy(dtype=float, copy=True)
+    missing = np.isnan(rate) & ~aus
+    if missing.any():
+        rate[missing] = fx.rate_at(frame.loc[missing, date_column])
+    rate[aus] = 1.0
+    frame[rate_column] = rate
+
+
+def realised_by_ticker(realised: pd.DataFrame) -> pd.DataFrame:
+    """Units sold, AUD cost, proceeds and gain of the SELL disposals per ticker, split by CGT discount eligibility."""
+    sells = realised[realised["action"] == "SELL"]
+    return sells.groupby(["Ticker", "cgt_discount"])[["units", "cost_AUD", "proceeds_AUD", "gain_AUD"]].sum()
+
+
+def lots_report_path(portfolioDir: str) -> str:
+    """One per-lot csv per ledger, named after the spreadsheet."""
+    return os.path.join(LOTS_DIR, os.path.splitext(os.path.basename(portfolioDir))[0] + ".csv")
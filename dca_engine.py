@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+from backtest_metrics import equity_curve, risk_metrics
+from fx_align import FX_COLUMN, align_fx
+from strategies import strategy_buys
+
+# Share of dividends withheld as tax per asset type, the default withholding model
+DIVIDEND_WITHHOLDING = {"US_Shares": 0.15, "Cryptocurrency": 0.0}
+# Brokerage per asset type, the default fee schedule: percent of the amount plus a fixed fee, with usd set
+# for brokers charging in USD (the fee is converted at the AUD rate of the trade)
+FEE_SCHEDULE = {
+    # Coinspot
+    "Cryptocurrency": {"percent": 0.01, "fixed": 0.0, "usd": False},
+    # Stake
+    "US_Shares": {"percent": 0.007, "fixed": 3.0, "usd": True},
+}
+
+
+def calc_brokerage_cost(ticker_type: dict, amount_aud, usd_aud_rate, fees: dict = None):
+    """
+    Amount left to invest and the brokerage paid, under fees (FEE_SCHEDULE by default). Works on
+    scalars and on arrays of amounts or rates.
+    """
+    ticker_category = ticker_type["type"]
+    fee = (fees or FEE_SCHEDULE).get(ticker_category)
+    if fee is None:
+        raise ValueError(f"No brokerage model for {ticker_category}")
+    brokerage_cost = fee["percent"] * amount_aud + fee["fixed"]
+    if not fee["usd"]:
+        return amount_aud - brokerage_cost, brokerage_cost
+    brokerage_cost = brokerage_cost * usd_aud_rate
+    usd = amount_aud / usd_aud_rate
+    remaining_amount = (usd - brokerage_cost) * usd_aud_rate
+    return remaining_amount, brokerage_cost
+
+
+def monthly_schedule(start, end, day: int = None) -> np.ndarray:
+    """Buy dates on day (start's day by default) of every month from start's month, up to but excluding end."""
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    day = day or start.day
+    months = np.arange(np.datetime64(start, "M"), np.datetime64(end, "M") + 1)
+    schedule = months.astype("datetime64[D]") + (day - 1)
+    schedule = schedule[schedule >= np.datetime64(start, "D")]
+    return schedule[schedule.astype("datetime64[ns]") < end.to_datetime64()]
+
+
+def dividend_events(bars: pd.DataFrame, buys: np.ndarray, units: np.ndarray, last: int, withholding: float,
+                    reinvest: bool = False) -> pd.DataFrame:
+    """
+    Every ex-dividend day up to the bar at last, joined with the units held going into it.
+
+    Units bought on an ex-dividend day miss that dividend, so the holding at each event is the
+    running total of the buys before it, found with one searchsorted over the event days. With
+    reinvest the net dividend buys more units at that day's close (no brokerage, like a DRP). The
+    compounding is applied with a running product of each event's growth factor instead of an
+    event-by-event replay. Costs O(events + buys), however long the history.
+    """
+    per_unit = bars["Dividends"].to_numpy(dtype=float)[:last + 1]
+    events = np.flatnonzero(per_unit != 0)
+    gross_per_unit = per_unit[events]
+    net_per_unit = gross_per_unit * (1 - withholding)
+    closes = bars["Close"].to_numpy(dtype=float)[events]
+    bought_before = np.searchsorted(buys, events, side="left")
+    if reinvest:
+        # growth_before[k] is how much a unit held since before event 0 has grown going into event k
+        growth_before = np.concatenate([[1.0], np.cumprod(1 + net_per_unit / closes)])
+        scaled = np.concatenate([[0.0], np.cumsum(units / growth_before[np.searchsorted(events, buys, side="right")])])
+        held = growth_before[:-1] * scaled[bought_before]
+    else:
+        held = np.concatenate([[0.0], np.cumsum(units)])[bought_before]
+    net = net_per_unit * held
+    return pd.DataFrame({
+        "Date": bars["Date"].to_numpy()[events], "Per Unit": gross_per_unit, "Units Held": held,
+        "Gross": gross_per_unit * held, "Withheld": (gross_per_unit - net_per_unit) * held, "Net": net,
+        "AUD Rate": bars[FX_COLUMN].to_numpy()[events],
+        "Reinvested Units": net / closes if reinvest else np.zeros(len(events)),
+    })
+
+
+def run_backtest(ticker_prices: pd.DataFrame, aud_prices: pd.DataFrame, asset_type: str, start, end,
+                 amount_added: float, strategy: str = "Blind", start_day: int = None, withholding: dict = None,
+                 reinvest: bool = False, fees: dict = None) -> dict:
+    """
+    Monthly dollar cost averaging into one ticker as arrays, the same trades backtester.main's loop makes.
+
+    Every scheduled buy is resolved to its trading day with one searchsorted and a lookup in the
+    strategy's next-signal array, then the units bought, brokerage, DCA price and dividends follow
+    from cumulative sums. The holding is valued at the last close on or before end, in AUD at the
+    AUD=X rate as of that day.
+
+    Brokerage follows fees (FEE_SCHEDULE by default). Dividends are taxed at withholding's rate for
+    asset_type (DIVIDEND_WITHHOLDING by default) and either paid out, converted to AUD at the rate
+    of their ex-dividend day, or reinvested.
+
+    The result carries the daily equity curve from the first buy and its risk metrics, see
+    backtest_metrics.
+    """
+    # Every bar with its AUD rate, joined once for the buys and the final valuation alike
+    return backtest_bars(align_fx(ticker_prices, aud_prices), asset_type, start, end, amount_added, strategy,
+                         start_day, withholding, reinvest, fees)
+
+
+def backtest_bars(bars: pd.DataFrame, asset_type: str, start, end, amount_added: float, strategy: str = "Blind",
+                  start_day: int = None, withholding: dict = None, reinvest: bool = False,
+                  fees: dict = None) -> dict:
+    """run_backtest on bars already joined with their AUD rate by align_fx, for callers running many backtests."""
+    dates = bars["Date"].to_numpy().astype("datetime64[D]")
+    rates = bars[FX_COLUMN].to_numpy()
+    buys, buy_prices = strategy_buys(bars, dates, monthly_schedule(start, end, start_day), strategy)
+    # A buy that never finds its day is dropped, the old loop walked past the end of the history forever
+    buys = buys[buys >= 0]
+
+    prices = buy_prices[buys]
+    usd_aud = rates[buys]
+    invested, brokerage = calc_brokerage_cost({"type": asset_type}, float(amount_added), usd_aud, fees)
+    invested = np.broadcast_to(invested, buys.shape)
+    brokerage = np.broadcast_to(brokerage, buys.shape)
+    units = invested / usd_aud / prices
+
+    # Valued at the last close on or before end
+    last = np.searchsorted(dates, np.datetime64(pd.Timestamp(end), "D"), side="right") - 1
+    dividends = dividend_events(bars, buys, units, last, (withholding or DIVIDEND_WITHHOLDING).get(asset_type, 0.0),
+                                reinvest)
+    curve = equity_curve(bars, buys, units, float(amount_added), dividends, last)
+    final_price = float(bars["Close"].iloc[last])
+    final_rate = float(rates[last])
+    total_units = float(units.sum() + dividends["Reinvested Units"].sum())
+    total = float(invested.sum())
+    value = total_units * final_price * final_rate
+    return {
+        "strategy": strategy,
+        "buys": pd.DataFrame({"Date": dates[buys].astype("datetime64[ns]"), "Price": prices, "AUD Rate": usd_aud,
+                              "Units": units, "Invested": invested, "Brokerage": brokerage}),
+        "dividend_events": dividends,
+        "curve": curve,
+        "total": total,
+        "brokerage": float(brokerage.sum()),
+        "units": total_units,
+        # Of the units bought, reinvested dividends are not part of it
+        "dca_price": float((prices * units).sum() / units.sum()) if len(units) else 0.0,
+        "final_date": pd.Timestamp(dates[last]),
+        "final_price": final_price,
+        "final_rate": final_rate,
+        "value": value,
+        "return": value / total - 1 if total else np.nan,
+        # Net of withholding, in AUD at the rate of each ex-dividend day
+        "dividends": float((dividends["Net"] * dividends["AUD Rate"]).sum()),
+        "dividend_tax": float((dividends["Withheld"] * dividends["AUD Rate"]).sum()),
+        **risk_metrics(curve),
+    }
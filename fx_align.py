@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+FX_COLUMN = "AUD Rate"
+
+
+def date_key(index) -> np.ndarray:
+    """
+    The calendar date of each bar in its exchange's own time zone, as datetime64[D]. Yahoo stamps
+    daily bars at local midnight, so dropping the zone keeps the date whatever the UTC offset is.
+    """
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.normalize().to_numpy().astype("datetime64[D]")
+
+
+def fx_rates(fx_prices: pd.DataFrame, column: str = "Close") -> pd.DataFrame:
+    """An FX history as a Date/rate frame on date keys, sorted, one rate per day and no gaps."""
+    rates = pd.DataFrame({"Date": date_key(fx_prices.index).astype("datetime64[ns]"),
+                          FX_COLUMN: fx_prices[column].to_numpy(dtype=float)}).dropna()
+    return rates.drop_duplicates("Date", keep="last").sort_values("Date", ignore_index=True)
+
+
+def align_fx(bars: pd.DataFrame, fx_prices: pd.DataFrame, column: str = "Close") -> pd.DataFrame:
+    """
+    bars on a Date column of date keys, with the FX rate as of each day (the last one on or before)
+    in FX_COLUMN. Both sides are keyed by their own local dates, so a New York close and a London
+    rate meet on the same date all year round, DST or not. NaN before the first rate.
+    """
+    aligned = bars.reset_index(drop=True)
+    aligned.insert(0, "Date", date_key(bars.index).astype("datetime64[ns]"))
+    return pd.merge_asof(aligned, fx_rates(fx_prices, column), on="Date", direction="backward")
+
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+LEDGER_CACHE_DIR = "ledger_cache"
+LEDGER_COLUMNS = 8  # A:H
+# Workbooks above this size are streamed row by row with openpyxl's read-only mode
+STREAMING_THRESHOLD_BYTES = 5 * 1024 * 1024
+STREAMING_CHUNK_ROWS = 50_000
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def ledger_key(path: str) -> str:
+    """The ledger's name plus a hash of its absolute path, so ledgers with equal names don't clash."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f"{stem}-{hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:12]}"
+
+
+def _cache_base(path: str) -> str:
+    return os.path.join(LEDGER_CACHE_DIR, ledger_key(path))
+
+
+def stream_excel(path: str) -> pd.DataFrame:
+    """Reads columns A:H of the first sheet with openpyxl read-only mode, a chunk of rows at a time."""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(max_col=LEDGER_COLUMNS, values_only=True)
+        header = next(rows, ())
+        columns = [name if name is not None else f"Unnamed: {i}" for i, name in enumerate(header)]
+        # Blank rows are kept like pd.read_excel keeps them, so row positions match the spreadsheet's.
+        # Trailing blank rows are dropped like it does, they are held back until a row with data follows
+        chunks, chunk, blank = [], [], []
+        for row in rows:
+            if all(value is None for value in row):
+                blank.append(row)
+                continue
+            chunk += blank
+            blank = []
+            chunk.append(row)
+            if len(chunk) >= STREAMING_CHUNK_ROWS:
+                chunks.append(pd.DataFrame(chunk, columns=columns))
+                chunk = []
+        chunks.append(pd.DataFrame(chunk, columns=columns))
+    finally:
+        workbook.close()
+    stocks = pd.concat(chunks, ignore_index=True).infer_objects()
+    # Empty cells are NaN in pd.read_excel, not None
+    stocks = stocks.where(stocks.notna(), np.nan)
+    # Match pd.read_excel, which types a column with no values at all as float NaN
+    empty = [column for column in stocks.columns if stocks[column].isna().all()]
+    stocks[empty] = stocks[empty].astype(float)
+    return stocks
+
+
+def read_source(path: str) -> pd.DataFrame:
+    """Reads a ledger straight from its source file, whatever the format."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return pd.read_csv(path, usecols=range(LEDGER_COLUMNS), parse_dates=["Date"], dayfirst=True)
+    if extension == ".parquet":
+        return pd.read_parquet(path).iloc[:, :LEDGER_COLUMNS]
+    if os.path.getsize(path) > STREAMING_THRESHOLD_BYTES:
+        return stream_excel(path)
+    return pd.read_excel(path, usecols="A:H")
+
+
+def load_ledger(path: str) -> pd.DataFrame:
+    """
+    Returns the ledger at path, reusing a columnar copy of an Excel workbook until it changes.
+
+    The cache is trusted while the workbook's mtime and size are unchanged; when only the mtime
+    moved (e.g. a sync client touched it) the content hash decides. CSV and Parquet ledgers are
+    read directly, they are already cheap to parse.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    if os.path.splitext(path)[1].lower() in (".csv", ".parquet"):
+        return read_source(path)
+
+    base = _cache_base(path)
+    metaPath = base + ".json"
+    stat = os.stat(path)
+    try:
+        with open(metaPath) as fp:
+            meta = json.load(fp)
+    except (FileNotFoundError, ValueError):
+        meta = {}
+    cachePath = meta.get("cache")
+    if cachePath and os.path.exists(cachePath) and meta.get("size") == stat.st_size:
+        if meta.get("mtime") == stat.st_mtime:
+            return _read_cache(cachePath)
+        sha = file_sha256(path)
+        if meta.get("sha256") == sha:
+            meta["mtime"] = stat.st_mtime
+            _write_meta(metaPath, meta)
+            return _read_cache(cachePath)
+    else:
+        sha = file_sha256(path)
+
+    logging.info("Ledger %s changed, rebuilding its columnar cache", path)
+    stocks = read_source(path)
+    os.makedirs(LEDGER_CACHE_DIR, exist_ok=True)
+    cachePath = _write_cache(base, stocks)
+    _write_meta(metaPath, {"source": os.path.abspath(path), "mtime": stat.st_mtime, "size": stat.st_size,
+                           "sha256": sha, "cache": cachePath})
+    return stocks
+
+
+def _write_cache(base: str, stocks: pd.DataFrame) -> str:
+    """Writes Parquet when pyarrow is installed and the columns allow it, otherwise a pickle."""
+    if _parquet_available():
+        try:
+            stocks.to_parquet(base + ".parquet", index=False)
+            return base + ".parquet"
+        except (TypeError, ValueError) as e:
+            # pyarrow's errors derive from these, e.g. a notes column mixing text and numbers
+            logging.info("Ledger cache falls back to pickle, Parquet rejected the columns: %s", e)
+    stocks.to_pickle(base + ".pkl")
+    return base + ".pkl"
+
+
+def _read_cache(cachePath: str) -> pd.DataFrame:
+    if cachePath.endswith(".parquet"):
+        return pd.read_parquet(cachePath)
+    return pd.read_pickle(cachePath)
+
+
+def _write_meta(metaPath: str, meta: dict):
+    with open(metaPath, "w") as fp:
+        json.dump(meta, fp)
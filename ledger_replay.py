@@ -0,0 +1,267 @@
+import sys
+from datetime import datetime as dt
+import numpy as np
+import pandas as pd
+from cpi_adjustment import cpi_at
+
+ACTIONS = ("BUY", "SELL", "TRANSACTION", "DIVIDEND", "DIVIDEND-FIAT")
+# Pseudo action for the rows that carry a previous replay's state into replay_ledger
+CHECKPOINT = "CHECKPOINT"
+STATE_COLUMNS = ("units", "dca_price", "init_units", "init_price", "init_AUD_exchange_rate", "sold_units",
+                 "sold_native", "transaction_units", "init_value_AUD", "init_value_CPI_base", "dividend_returns",
+                 "dividend_fiat_native", "fiat_since_recalc_native", "realised_sell_AUD", "realised_fiat_native",
+                 "asset_type")
+# State columns that are per-ticker sums of the replayed rows, the rest are the last row's values
+SUMMED_COLUMNS = ("sold_units", "sold_native", "transaction_units", "init_value_AUD", "init_value_CPI_base",
+                  "dividend_returns", "dividend_fiat_native", "fiat_since_recalc_native", "realised_sell_AUD",
+                  "realised_fiat_native")
+LAST_COLUMNS = ("units", "dca_price", "init_units", "init_price", "init_AUD_exchange_rate")
+ASSET_TYPES = ("AUS Market", "Cryptocurrency", "US Market")
+PARITY_TOLERANCE = 1e-9
+
+
+def asset_types(tickers: pd.Series) -> pd.Categorical:
+    """Classifies tickers the same way Security.__init__ does."""
+    tickers = tickers.astype(str)
+    codes = np.select([tickers.str.endswith("AX"), tickers.str.endswith("USD")], [0, 1], 2)
+    return pd.Categorical.from_codes(codes, categories=ASSET_TYPES)
+
+
+def _running_total(values: np.ndarray, tickers: pd.Series) -> np.ndarray:
+    """Per-ticker running total, summed left to right like the Security handlers so zero checks agree."""
+    return pd.Series(values).groupby(tickers, sort=False).transform(lambda group: np.cumsum(group.to_numpy())).to_numpy()
+
+
+def replay_rows(stocks: pd.DataFrame, initial: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Replays the transaction sheet column-wise, one result row per ledger row.
+
+    The STATE_COLUMNS sums of a ticker's rows, with the last units/DCA price and the first
+    buy's fields, are its state after the ledger. init_value_running and fiat_since_recalc_running
+    are the ticker's initial value and retained fiat dividends as of each row.
+    """
+    ledger = pd.DataFrame({
+        "Date": stocks["Date"],
+        "Ticker": stocks["Ticker"],
+        "Action": stocks["Action"],
+        "Units": pd.to_numeric(stocks["Units"], errors="coerce"),
+        "Price": pd.to_numeric(stocks["Price"], errors="coerce"),
+        # Column H holds the AUD exchange rate at the time of the transaction
+        "Rate": pd.to_numeric(stocks[stocks.columns[7]], errors="coerce"),
+    })
+    ledger = ledger[ledger["Action"].isin(ACTIONS)]
+    if initial is not None:
+        # Each ticker of a previous state enters as one CHECKPOINT row that seeds every running total
+        seeds = pd.DataFrame({"Ticker": initial.index, "Action": CHECKPOINT, "Units": initial["units"].to_numpy()})
+        ledger = pd.concat([seeds, ledger])
+    ledger = ledger.reset_index(drop=True)
+    action = ledger["Action"].to_numpy()
+    is_seed = action == CHECKPOINT
+    is_buy = action == "BUY"
+    is_sell = action == "SELL"
+    is_transaction = action == "TRANSACTION"
+    is_disposal = is_sell | is_transaction
+    is_drip = action == "DIVIDEND"
+    is_fiat = action == "DIVIDEND-FIAT"
+    units = ledger["Units"].to_numpy(dtype=float)
+    price = ledger["Price"].to_numpy(dtype=float)
+    rate = ledger["Rate"].to_numpy(dtype=float)
+    tickers = ledger["Ticker"]
+    seed = (initial if initial is not None else pd.DataFrame(columns=STATE_COLUMNS)).reindex(tickers)
+
+    def seeded(column: str, values: np.ndarray) -> np.ndarray:
+        return np.where(is_seed, seed[column].to_numpy(dtype=float), values)
+
+    first_actions = ledger.groupby("Ticker", sort=False)["Action"].first()
+    not_bought = first_actions[~first_actions.isin(("BUY", CHECKPOINT))]
+    if len(not_bought):
+        print(f"{not_bought.index[0]} has not been bought prior to the sell event, please review the portfolio "
+              f"spreadsheet")
+        sys.exit()
+
+    # Units held after each row, and before it for the oversell check and the DCA weighting
+    delta = np.select([is_buy | is_drip | is_seed, is_disposal], [units, -units], 0.0)
+    held = _running_total(delta, tickers)
+    held_before = pd.Series(held).groupby(tickers, sort=False).shift(fill_value=0.0).to_numpy()
+    oversold = is_disposal & (held_before < units)
+    if oversold.any():
+        print(f"Error: Units sold for {tickers[np.argmax(oversold)]} cannot be greater than units pre-existing in "
+              f"portfolio. Please update the portfolio spreadsheet with corrected units")
+        sys.exit()
+
+    # dca_k = dca_{k-1} * held_before / held + price * units / held on BUY rows, unchanged elsewhere.
+    # A BUY into zero units (or a checkpoint) restarts the recurrence, which is then solved per segment
+    # with cumprod/cumsum: dca_k = F_k * sum(b_j / F_j) where F is the running product of the factors.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factor = np.where(is_buy, held_before / held, 1.0)
+        addend = seeded("dca_price", np.where(is_buy, price * units / held, 0.0))
+    restart = (is_buy & (held_before == 0.0)) | is_seed
+    segment = pd.Series(restart.astype(int)).groupby(tickers, sort=False).cumsum()
+    keys = [tickers, segment]
+    running_factor = pd.Series(np.where(restart, 1.0, factor)).groupby(keys, sort=False).cumprod().to_numpy()
+    dca = running_factor * pd.Series(addend / running_factor).groupby(keys, sort=False).cumsum().to_numpy()
+
+    ledger["InitUnits"] = seeded("init_units", units)
+    ledger["InitPrice"] = seeded("init_price", price)
+    ledger["InitRate"] = seeded("init_AUD_exchange_rate", rate)
+    firsts = ledger.groupby("Ticker", sort=False).first()
+    init_units = tickers.map(firsts["InitUnits"]).to_numpy(dtype=float)
+    init_price = tickers.map(firsts["InitPrice"]).to_numpy(dtype=float)
+    init_rate = tickers.map(firsts["InitRate"]).to_numpy(dtype=float)
+
+    # Initial value is rebuilt from the DCA price on every disposal, then grows with later buys
+    disposals_seen = pd.Series(is_disposal.astype(int)).groupby(tickers, sort=False).cumsum()
+    after_last_disposal = (disposals_seen == disposals_seen.groupby(tickers, sort=False).transform("max")).to_numpy()
+    reset_value = np.where(held == 0.0, init_units * init_price * init_rate, held * dca * init_rate)
+    buy_value = np.where(is_buy, units * price * rate, 0.0)
+    cpi_base = np.zeros(len(ledger))
+    if is_buy.any():
+        cpi_base[is_buy] = buy_value[is_buy] / cpi_at(ledger["Date"][is_buy])
+
+    # Fiat dividends only stay in the current value until the next disposal or DRIP recalculates it
+    fiat = seeded("dividend_fiat_native", np.where(is_fiat, price, 0.0))
+    recalcs_seen = pd.Series((is_disposal | is_drip).astype(int)).groupby(tickers, sort=False).cumsum()
+    after_last_recalc = (recalcs_seen == recalcs_seen.groupby(tickers, sort=False).transform("max")).to_numpy()
+    fiat_to_date = pd.Series(fiat).groupby(tickers, sort=False).cumsum().to_numpy()
+
+    rows = pd.DataFrame({
+        "Ticker": tickers,
+        "sold_units": seeded("sold_units", np.where(is_disposal, units, 0.0)),
+        "sold_native": seeded("sold_native", np.where(is_sell, units * price, 0.0)),
+        "transaction_units": seeded("transaction_units", np.where(is_transaction, units, 0.0)),
+        "init_value_AUD": np.where(after_last_disposal,
+                                   seeded("init_value_AUD", np.where(is_disposal, reset_value, buy_value)), 0.0),
+        "init_value_CPI_base": seeded("init_value_CPI_base", cpi_base),
+        "dividend_returns": seeded("dividend_returns", np.where(is_drip, units, 0.0)),
+        "dividend_fiat_native": fiat,
+        "fiat_since_recalc_native": np.where(after_last_recalc,
+                                             seeded("fiat_since_recalc_native", np.where(is_fiat, fiat, 0.0)), 0.0),
+        "realised_sell_AUD": seeded("realised_sell_AUD", np.where(is_sell, (price - dca) * held, 0.0)),
+        "realised_fiat_native": seeded("realised_fiat_native", np.where(is_fiat, fiat_to_date, 0.0)),
+    })
+
+    rows["Date"] = ledger["Date"]
+    rows["units"] = held
+    rows["dca_price"] = dca
+    rows["init_units"] = init_units
+    rows["init_price"] = init_price
+    rows["init_AUD_exchange_rate"] = init_rate
+    # Running versions of the two per-ticker values that reset, for valuing the ledger as of any row
+    disposal_keys = [tickers, disposals_seen]
+    rows["init_value_running"] = pd.Series(seeded("init_value_AUD", np.where(is_disposal, reset_value, buy_value))) \
+        .groupby(disposal_keys, sort=False).cumsum().to_numpy()
+    rows["fiat_since_recalc_running"] = pd.Series(
+        seeded("fiat_since_recalc_native", np.where(is_fiat, fiat, 0.0))).groupby([tickers, recalcs_seen],
+                                                                               sort=False).cumsum().to_numpy()
+    return rows
+
+
+def replay_ledger(stocks: pd.DataFrame, initial: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Replays the transaction sheet column-wise, one row per ticker in the result.
+
+    The returned state does not depend on market prices or the evaluation date, so it can be
+    valued with value_holdings() at any time, or passed back as initial to replay only rows
+    appended since it was built.
+    """
+    rows = replay_rows(stocks, initial)
+    by_ticker = rows.groupby("Ticker", sort=False)
+    state = by_ticker[list(SUMMED_COLUMNS)].sum()
+    state[list(LAST_COLUMNS)] = by_ticker[list(LAST_COLUMNS)].last()
+    state["asset_type"] = asset_types(state.index.to_series())
+    state.index.name = "Ticker"
+    return state[list(STATE_COLUMNS)]
+
+
+def value_holdings(state: pd.DataFrame, closes, usd_to_aud: float, evaluation_date=None):
+    """
+    Values replayed ledger state against the latest closes, USD/AUD rate and CPI at evaluation_date.
+
+    Returns the holdings with the same fields Security exposes, and the realised profit/loss.
+    """
+    holdings = state.copy()
+    aus = (holdings["asset_type"] == "AUS Market").to_numpy()
+    close = pd.Series(closes, dtype=float).reindex(holdings.index).to_numpy()
+    current_rate = np.where(aus, 1.0, usd_to_aud)
+    sold_native = holdings["sold_native"] + holdings["transaction_units"] * close
+
+    holdings["curr_price"] = close
+    holdings["init_value_CPI_Adjusted_AUD"] = holdings["init_value_CPI_base"] * cpi_at(evaluation_date or dt.now())
+    holdings["current_AUD_exchange_rate"] = current_rate
+    holdings["dividend_fiat_returns"] = holdings["dividend_fiat_native"] * current_rate
+    holdings["curr_value_AUD"] = (holdings["units"] * close + holdings["fiat_since_recalc_native"]) * current_rate
+    holdings["sold_value_AUD"] = sold_native * current_rate
+    with np.errstate(divide="ignore", invalid="ignore"):
+        holdings["sold_dca_price"] = np.where(holdings["sold_units"] > 0, sold_native / holdings["sold_units"], 0.0)
+        returned = holdings["curr_value_AUD"] + holdings["sold_value_AUD"] + holdings["dividend_fiat_returns"]
+        holdings["percent_returns"] = returned / holdings["init_value_AUD"] * 100 - 100
+        holdings["percent_returns_CPI_Adjusted"] = returned / holdings["init_value_CPI_Adjusted_AUD"] * 100 - 100
+    holdings["dividend_value_AUD"] = holdings["dividend_returns"] * close * current_rate
+    holdings["dividend_fiat_value_AUD"] = holdings["dividend_fiat_returns"] * current_rate
+
+    realised_profit_loss = (holdings["realised_sell_AUD"].sum()
+                            + (holdings["realised_fiat_native"] * current_rate).sum())
+    # One typed float64 array per field, with the tickers and asset types stored as categoricals
+    numeric = holdings.columns.drop("asset_type")
+    holdings = holdings.astype(dict.fromkeys(numeric, np.float64))
+    # A state loaded from a checkpoint carries asset_type as plain strings
+    holdings["asset_type"] = pd.Categorical(holdings["asset_type"], categories=ASSET_TYPES)
+    holdings.index = pd.CategoricalIndex(holdings.index, name="Ticker")
+    return holdings, realised_profit_loss
+
+
+def asset_class_totals(holdings: pd.DataFrame) -> pd.DataFrame:
+    """Initial, CPI adjusted and current AUD value per asset class, every class present even when empty."""
+    return holdings.groupby("asset_type", observed=False)[
+        ["init_value_AUD", "init_value_CPI_Adjusted_AUD", "curr_value_AUD"]].sum()
+
+
+def check_parity(stocks: pd.DataFrame, closes, usd_to_aud: float) -> list:
+    """Replays the ledger through both engines and returns the fields where they disagree."""
+    from main import replaySecurities
+
+    stonks, expected_profit_loss = replaySecurities(stocks, closes, usd_to_aud)
+    holdings, realised_profit_loss = value_holdings(replay_ledger(stocks), closes, usd_to_aud)
+    getters = {
+        "units": "getUnits",
+        "dca_price": "getInitPrice",
+        "curr_price": "getCurrPrice",
+        "init_value_AUD": "getInitValue",
+        "init_value_CPI_Adjusted_AUD": "getInitCPIAdjustedValue",
+        "curr_value_AUD": "getCurrValue",
+        "dividend_value_AUD": "getDividendReturns",
+        "dividend_fiat_value_AUD": "getDividendFiatReturns",
+        "percent_returns": "getPercentReturns",
+        "percent_returns_CPI_Adjusted": "getPercentReturnsCPIAdj",
+    }
+    attributes = ("sold_units", "sold_dca_price", "sold_value_AUD", "dividend_returns", "asset_type")
+    mismatches = []
+    if sorted(stonks) != sorted(holdings.index):
+        mismatches.append(("tickers", sorted(stonks), sorted(holdings.index)))
+        return mismatches
+    for ticker, security in stonks.items():
+        expected = {column: getattr(security, getter)() for column, getter in getters.items()}
+        expected.update({column: getattr(security, column) for column in attributes})
+        for column, value in expected.items():
+            actual = holdings.at[ticker, column]
+            if isinstance(value, str):
+                same = value == actual
+            else:
+                same = np.isclose(actual, value, rtol=PARITY_TOLERANCE, atol=PARITY_TOLERANCE, equal_nan=True)
+            if not same:
+                mismatches.append((f"{ticker}.{column}", value, actual))
+    if not np.isclose(realised_profit_loss, expected_profit_loss, rtol=PARITY_TOLERANCE, atol=PARITY_TOLERANCE):
+        mismatches.append(("realised_profit_loss", expected_profit_loss, realised_profit_loss))
+    return mismatches
+
+
+if __name__ == '__main__':
+    # Offline parity check: values every ticker at its last ledger price and the last recorded AUD rate
+    ledger = pd.read_excel(sys.argv[1], usecols="A:H")
+    last_prices = ledger.dropna(subset=["Price"]).groupby("Ticker")["Price"].last()
+    usd_rate = ledger[ledger.columns[7]].dropna().iloc[-1]
+    differences = check_parity(ledger, last_prices, usd_rate)
+    for field, expected_value, actual_value in differences:
+        print(f"{field}: Security={expected_value} replay={actual_value}")
+    print(f"{len(differences)} mismatches between the Security and replay engines")
+    sys.exit(1 if differences else 0)
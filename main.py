@@ -1,14 +1,27 @@
 import pandas as pd
-import yfinance as yf
-import math
-import matplotlib.pyplot as plt
+import numpy as np
 import sys
+import os
 import getopt
 import logging
-import openpyxl
 from datetime import datetime as dt
-import ausdex
+from cpi_adjustment import inflation_adjusted
+from ledger_ingest import load_ledger
+from ledger_replay import asset_class_totals, value_holdings
+from checkpoint import checkpoint_path, replay_from_checkpoint
+from cost_basis import LOT_METHODS, fx_table, lots_report_path, match_lots, read_lot_selection, realised_by_ticker
+from price_store import PriceStore
+from profiling import enable as enableProfiling, span
+from report_charts import downsample_history, start_chart_worker
+from value_backfill import daily_value_curve
+from value_history import ValueHistory, append_csv_row, history_store_path, write_csv
 WRITE_TO_FILE=1
+#Holdings columns shown in the summary table, in order, with their printed headers
+SUMMARY_COLUMNS = {"units": "Units", "dca_price": "Init. Price", "curr_price": "Close", "init_value_AUD": "Init. AUD Value",
+                   "init_value_CPI_Adjusted_AUD": "Initial AUD CPI Adj.", "sold_value_AUD": "Sold AUD Value",
+                   "curr_value_AUD": "Current AUD Value", "dividend_value_AUD": "Dividends Val.",
+                   "dividend_fiat_value_AUD": "Dividend Fiat", "percent_returns": "% Returns",
+                   "percent_returns_CPI_Adjusted": "% CPI Adj."}
 
 class Security:
     def __init__(self, ticker, units, dca_price, prevClose, init_buy_date, init_AUD_exchange_rate = 1, current_AUD_exchange_rate = 1):
@@ -34,7 +47,7 @@ class Security:
             self.asset_type = "US Market"
 
         self.init_value_AUD = self.setValueAUD(self.dca_price, "initial")
-        self.init_value_CPI_Adjusted_AUD = ausdex.calc_inflation(value=self.init_value_AUD, original_date=init_buy_date, location="Brisbane")
+        self.init_value_CPI_Adjusted_AUD = inflation_adjusted(self.init_value_AUD, init_buy_date)
         self.curr_value_AUD = self.setValueAUD(self.curr_price, "current")
         self.sold_value_AUD = 0
         self.percent_returns = self.calculatePercentReturns()
@@ -49,7 +62,7 @@ class Security:
         self.units  = initUnits + units
         self.dca_price = (initPriceBought * initUnits + priceBought * units) / self.units
         self.init_value_AUD = initValueAUD + units * priceBought * AUD_exchange_rate
-        self.init_value_CPI_Adjusted_AUD = self.init_value_CPI_Adjusted_AUD + ausdex.calc_inflation(value=units * priceBought * AUD_exchange_rate, original_date=buy_date, location="Brisbane")
+        self.init_value_CPI_Adjusted_AUD = self.init_value_CPI_Adjusted_AUD + inflation_adjusted(units * priceBought * AUD_exchange_rate, buy_date)
         self.curr_value_AUD = currValueAUD + units * currPrice * self.current_AUD_exchange_rate
         self.percent_returns = self.calculatePercentReturns()
 
@@ -136,7 +149,35 @@ class Security:
         value = self.curr_value_AUD + self.sold_value_AUD + self.dividend_fiat_returns
         return value / self.init_value_AUD * 100 - 100
 
+def replaySecurities(stocks, closes, usdToAUD):
+    """Replays the transaction sheet one row at a time through Security objects."""
+    stonks = {}
+    realisedProfitLoss = 0
+    for ticker in stocks.itertuples():
+        if ticker.Action == "BUY":
+            if ticker.Ticker in stonks:
+                stonks[ticker.Ticker].dollarCostAveragingHandler(ticker.Units, ticker.Price, ticker._8, ticker.Date)
+            else:
+                stonks[ticker.Ticker] = Security(ticker.Ticker, ticker.Units, ticker.Price, closes[ticker.Ticker], ticker.Date, ticker._8, usdToAUD)
+        elif ticker.Action in ("SELL", "TRANSACTION"):
+            if ticker.Ticker in stonks:
+                if ticker.Action == "SELL":
+                    realisedProfitLoss += stonks[ticker.Ticker].sellEventHandler(ticker.Units, ticker.Price)
+                else:
+                    stonks[ticker.Ticker].sellEventHandler(ticker.Units, stonks[ticker.Ticker].curr_price)
+            else:
+                print(f"{ticker.Ticker} has not been bought prior to the sell event, please review the portfolio "
+                      f"spreadsheet")
+                sys.exit()
+        elif ticker.Action == "DIVIDEND":
+            stonks[ticker.Ticker].dividend_addition(ticker.Units)
+        elif ticker.Action == "DIVIDEND-FIAT":
+            stonks[ticker.Ticker].setDividendFiatReturns(ticker.Price, usdToAUD)
+            realisedProfitLoss += stonks[ticker.Ticker].dividend_fiat_returns
+    return stonks, realisedProfitLoss
+
 def plotPieChart(labels, value):
+    import matplotlib.pyplot as plt
     fig1, ax1 = plt.subplots()
     ax1.pie(value, labels=labels, autopct='%1.1f%%', startangle=90)
     ax1.axis('equal')
@@ -151,185 +192,254 @@ def return_date_ISO_format(date):
     print(dmy)
 
 
+def readLedger(portfolioDir):
+    """Reads the transaction spreadsheet, exiting with the usual message when it is missing."""
+    try:
+        stocks = load_ledger(portfolioDir)
+        # Drops any empty values
+        # stocks = stocks.dropna()
+        logging.debug("Stock portfolio input file: %s", stocks)
+    except FileNotFoundError:
+        print(f"{portfolioDir} not found. Require an excel spreadsheet (or csv/parquet) listing transactions. Please see script usage page")
+        sys.exit()
+    return stocks
+
+
+def ledgerTickers(stocks):
+    """Unique tickers of a ledger, in first seen order."""
+    return [ticker for ticker in stocks["Ticker"].dropna().unique() if ticker != "AUD=X"]
+
+
+def latestCloses(nameTickers, offline=False):
+    """Refreshes the price store for nameTickers (unless offline) and returns their latest closes."""
+    priceStore = PriceStore()
+    if offline:
+        logging.info("Offline mode, valuing from the latest stored closes")
+    else:
+        priceStore.refresh(nameTickers)
+    #Latest valid close for every ticker, including the USD/AUD exchange rate
+    closes = priceStore.latest_closes(nameTickers)
+    priceStore.close()
+    missingCloses = closes[closes.isna()]
+    if len(missingCloses):
+        print(f"No stored close for {', '.join(missingCloses.index)}. Run without --offline to fetch prices, exiting...")
+        sys.exit()
+    return closes
+
+
+def openValueHistory(portValueDir, askToCreate=True):
+    """Opens the value history store for -o, importing a legacy csv the first time. Returns it and the csv path."""
+    historyPath = history_store_path(portValueDir)
+    legacyCsv = portValueDir if historyPath != portValueDir else None
+    if askToCreate and not os.path.exists(historyPath) and not (legacyCsv and os.path.exists(legacyCsv)):
+        userResponse = input(f"{portValueDir} not found. Should a new csv be created? [y/n]: ")
+        if userResponse == "y":
+            print("Creating new csv...")
+        elif userResponse == "n":
+            print("Not creating a new csv, please review arguments, exiting...")
+            sys.exit()
+        else:
+            print("Correct input of [y/n] not detected, exiting...")
+            sys.exit()
+    os.makedirs(os.path.dirname(historyPath) or ".", exist_ok=True)
+    newHistoryStore = not os.path.exists(historyPath)
+    valueHistory = ValueHistory(historyPath)
+    if newHistoryStore and legacyCsv and os.path.exists(legacyCsv):
+        valueHistory.import_csv(legacyCsv)
+    return valueHistory, legacyCsv
+
+
+def recordPortfolioValue(valueHistory, legacyCsv, value, percentage):
+    """Upserts todays value, the history is never read or rewritten in full."""
+    if WRITE_TO_FILE:
+        valueHistory.upsert(dt.today(), value, percentage)
+        if legacyCsv:
+            append_csv_row(legacyCsv, dt.today(), value, percentage)
+
+
+def backfillHistory(stocks, valueHistory, legacyCsv, nameTickers, offline=False):
+    """Rebuilds every day of the value history from the first ledger date, replacing the stored values."""
+    start = pd.to_datetime(stocks["Date"]).min().strftime("%Y-%m-%d")
+    priceStore = PriceStore()
+    if not offline:
+        priceStore.backfill(nameTickers, start)
+    closeMatrix = priceStore.close_matrix(nameTickers, start)
+    priceStore.close()
+    #Ledger rates cover the days before the stored AUD=X history
+    usdToAUD = fx_table(stocks, closeMatrix["AUD=X"].dropna()).as_series()
+    curve = daily_value_curve(stocks, closeMatrix.drop(columns="AUD=X"), usdToAUD)
+    valueHistory.upsert_many(curve)
+    if legacyCsv:
+        write_csv(legacyCsv, valueHistory.range())
+    logging.info("Backfilled %d days of portfolio value history", len(curve))
+    return len(curve)
+
+
+def summarisePortfolio(holdings, realisedProfitLoss):
+    """Builds the text report for valued holdings. Returns it with the initial/current/percentage totals."""
+    classTotals = asset_class_totals(holdings)
+    initPortValue = {"All": classTotals["init_value_AUD"].sum(),
+                     "All CPI Adj.": classTotals["init_value_CPI_Adjusted_AUD"].sum(),
+                     **classTotals["init_value_AUD"].to_dict()}
+    currPortValue = {"All": classTotals["curr_value_AUD"].sum(), "All CPI Adj.": 0,
+                     **classTotals["curr_value_AUD"].to_dict()}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percPortChange = {key: np.float64(currPortValue["All" if key == "All CPI Adj." else key]) / initPortValue[key] * 100 - 100
+                          for key in initPortValue}
+
+    #Formatting happens once, on the whole table
+    portfolioDf = holdings.sort_index()[list(SUMMARY_COLUMNS)].rename(columns=SUMMARY_COLUMNS).reset_index()
+    report = [portfolioDf.to_string(float_format="{:.2f}".format)]
+    report.append(f"Initial Portfolio Value is: ${initPortValue['All']:.2f}")
+    report.append(f"Initial Portfolio Value CPI Adj. is: ${initPortValue['All CPI Adj.']:.2f}")
+    report.append(f"Current Portfolio Value is: ${currPortValue['All']:.2f}")
+    report.append(f"Percentage Portfolio Performance: {percPortChange['All']:.2f}")
+    report.append(f"Percentage Portfolio Performance CPI Adj.: {percPortChange['All CPI Adj.']:.2f}")
+    report.append(f"Realised Profit/Loss: ${realisedProfitLoss:.2f}AUD\n")
+
+    report.append(f"Initial Aus Market Portfolio Value is: ${initPortValue['AUS Market']:.2f}")
+    report.append(f"Current Aus Market Portfolio Value is: ${currPortValue['AUS Market']:.2f}")
+    report.append(f"Aus Market Percentage Portfolio Performance: {percPortChange['AUS Market']:.2f}%\n")
+
+    report.append(f"Initial Cryptocurrency Portfolio Value is: ${initPortValue['Cryptocurrency']:.2f}")
+    report.append(f"Current Cryptocurrency Portfolio Value is: ${currPortValue['Cryptocurrency']:.2f}")
+    report.append(f"Cryptocurrency Percentage Portfolio Performance: {percPortChange['Cryptocurrency']:.2f}%\n")
+
+    report.append(f"US Market Initial Portfolio Value is: ${initPortValue['US Market']:.2f}")
+    report.append(f"US Market Current Portfolio Value is: ${currPortValue['US Market']:.2f}")
+    report.append(f"US Market Percentage Portfolio Performance: {percPortChange['US Market']:.2f}%")
+    return "\n".join(report), initPortValue, currPortValue, percPortChange
+
+
+def reportLots(stocks, portfolioDir, method, lotSelectionPath=''):
+    """Matches sales to lots, writes the per-lot csv for tax reporting and returns the per-ticker summary."""
+    if method not in LOT_METHODS:
+        print(f"Lot method must be one of {', '.join(LOT_METHODS)}, exiting...")
+        sys.exit()
+    lotSelection = read_lot_selection(lotSelectionPath) if lotSelectionPath else None
+    priceStore = PriceStore()
+    fx = fx_table(stocks, priceStore.history("AUD=X"))
+    priceStore.close()
+    realised, openLots = match_lots(stocks, method, fx, lotSelection)
+    lotsPath = lots_report_path(portfolioDir)
+    os.makedirs(os.path.dirname(lotsPath), exist_ok=True)
+    realised.to_csv(lotsPath, index=False)
+    summary = realised_by_ticker(realised).to_string(float_format="{:.2f}".format)
+    return f"Realised gains by lot ({method.upper()}), per-lot detail in {lotsPath}:\n{summary}"
+
+
+def chartInputs(holdings, currPortValue):
+    """Labels and values for the ticker and asset class allocation pies."""
+    tickerList = list(holdings.index)
+    tickerValue = list(holdings["curr_value_AUD"])
+    classLabels = ["Aus Market", "Cryptocurrency", "US Market"]
+    classValues = [currPortValue["AUS Market"], currPortValue["Cryptocurrency"], currPortValue["US Market"]]
+    return tickerList, tickerValue, classLabels, classValues
+
+
 def main(argv):
 
     logging.basicConfig(filename="portfolioTracker.log", encoding="utf-8", filemode="w", format="%(asctime)s - %(levelname)s: %(message)s", level=logging.DEBUG)
     portfolioDir = ''
     portValueDir = ''
-    stonks = {}
-    nameTickers = "AUD=X"
-    initPortValue = {"All": 0, "All CPI Adj.": 0, "AUS Market": 0, "Cryptocurrency": 0, "US Market": 0}
-    currPortValue = {"All": 0, "All CPI Adj.": 0, "AUS Market": 0, "Cryptocurrency": 0, "US Market": 0}
-    percPortChange = {"All": 0, "All CPI Adj.": 0, "AUS Market": 0, "Cryptocurrency": 0, "US Market": 0}
-    realisedProfitLoss = 0
-    tickerList = []
-    tickerValue = []
-    csvFound = True
+    offline = False
+    chartsDir = ''
+    chartFormat = "png"
+    lotMethod = ''
+    lotSelectionPath = ''
+    backfill = False
+    profilePath = ''
 
     try:
-        opts, args = getopt.getopt(argv, "hi:o:", ["ifile=", "ofile="])
+        opts, args = getopt.getopt(argv, "hi:o:", ["ifile=", "ofile=", "offline", "charts=", "chart-format=", "lots=",
+                                                   "lot-selection=", "backfill", "profile="])
     except getopt.GetoptError:
-        print('main.py -i <portfolio path> -o <portfolio output directory>')
+        print('main.py -i <portfolio path> -o <portfolio output directory> [--offline] [--charts <chart directory> [--chart-format png|svg]] [--lots fifo|lifo|specific [--lot-selection <csv>]] [--backfill] [--profile <json path>]')
         sys.exit(2)
     for opt, arg in opts:
         if opt == '-h':
-            print('test.py -i <portfolio path> -o <portfolio output directory>')
+            print('main.py -i <portfolio path> -o <portfolio output directory> [--offline] [--charts <chart directory> [--chart-format png|svg]] [--lots fifo|lifo|specific [--lot-selection <csv>]] [--backfill] [--profile <json path>]')
             sys.exit()
         elif opt in ("-i", "--ifile"):
             portfolioDir = arg
         elif opt in ("-o", "--ofile"):
             portValueDir = arg
+        elif opt == "--offline":
+            offline = True
+        elif opt == "--charts":
+            chartsDir = arg
+        elif opt == "--chart-format":
+            chartFormat = arg
+        elif opt == "--lots":
+            lotMethod = arg.lower()
+        elif opt == "--lot-selection":
+            lotSelectionPath = arg
+        elif opt == "--backfill":
+            backfill = True
+        elif opt == "--profile":
+            profilePath = arg
     logging.info("Input file is: %s", portfolioDir)
     logging.info("Output file is: %s", portValueDir)
+    if profilePath:
+        enableProfiling("main", profilePath)
 
     # Import initial portfolio investment and output csv as a DataFrame
-    try:
-        portfolio = pd.read_excel(portfolioDir, usecols="A:H")
-        stocks = pd.DataFrame(portfolio)
-        # Drops any empty values
-        # stocks = stocks.dropna()
-        logging.debug("Stock portfolio input file: %s", stocks)
-    except FileNotFoundError:
-        print(f"{portfolio} not found. Require an excel spreadsheet listing transactions. Please see script usage page")
-        sys.exit()
-    try:
-        portValue = pd.read_csv(portValueDir)
-        portValDf = pd.DataFrame(portValue)
-    except FileNotFoundError:
-        userResponse = input(f"{portValueDir} not found. Should a new csv be created? [y/n]: ")
-        if userResponse == "y":
-            print("Creating new csv...")
-            csvFound = False
-        elif userResponse == "n":
-            print("Not creating a new csv, please review arguments, exiting...")
-            sys.exit()
-        else:
-            print("Correct input of [y/n] not detected, exiting...")
-            sys.exit()
-
+    with span("ledger_read"):
+        stocks = readLedger(portfolioDir)
+    valueHistory, legacyCsv = openValueHistory(portValueDir)
 
     #Build a list of unique ticker names to query Yahoo Finance with - need the current USD/AUD exhange rate so prefilled
-    # logging.debug("Stock portfolio input file: %s", stocks)
-    for ticker in stocks.itertuples():
-        if ticker.Ticker not in nameTickers:
-            nameTickers += " " + ticker.Ticker
-
-    dataDf = pd.DataFrame(yf.download(nameTickers, period="5d", prepost=True, threads=1))
-    logging.debug(dataDf.to_string())
-    #Get latest USD/AUD exchange rate
-    #Start from the last row available, iterate back until value is not null to get latest closing value
-    dateOffset = len(dataDf['Close']['AUD=X'].index) - 1
-    while math.isnan(dataDf['Close']['AUD=X'].iloc[dateOffset]):
-        dateOffset -= 1
-    usdToAUD = dataDf['Close']['AUD=X'].iloc[dateOffset]
-    #Loop through each ticker
-    for ticker in stocks.itertuples():
-        if ticker.Action == "BUY":
-            if ticker.Ticker in stonks:
-                stonks[ticker.Ticker].dollarCostAveragingHandler(ticker.Units, ticker.Price, ticker._8, ticker.Date)
-            else:
-                dateOffset = len(dataDf['Close'][ticker.Ticker].index) - 1
-                while math.isnan(dataDf['Close'][ticker.Ticker].iloc[dateOffset]):
-                    dateOffset -= 1
-                prevClose = dataDf['Close'][ticker.Ticker].iloc[dateOffset]
-                stonks[ticker.Ticker] = Security(ticker.Ticker, ticker.Units, ticker.Price, prevClose, ticker.Date, ticker._8, usdToAUD)
-        elif ticker.Action in ("SELL", "TRANSACTION"):
-            if ticker.Ticker in stonks:
-                if ticker.Action == "SELL":
-                    realisedProfitLoss += stonks[ticker.Ticker].sellEventHandler(ticker.Units, ticker.Price)
-                else:
-                    stonks[ticker.Ticker].sellEventHandler(ticker.Units, stonks[ticker.Ticker].curr_price)
-            else:
-                print(f"{ticker.Ticker} has not been bought prior to the sell event, please review the portfolio "
-                      f"spreadsheet")
-                sys.exit()
-        elif ticker.Action == "DIVIDEND":
-            stonks[ticker.Ticker].dividend_addition(ticker.Units)
-        elif ticker.Action == "DIVIDEND-FIAT":
-            stonks[ticker.Ticker].setDividendFiatReturns(ticker.Price, usdToAUD)
-            realisedProfitLoss += stonks[ticker.Ticker].dividend_fiat_returns
-
-
-
-    portfolioDf = {"Ticker": [], "Units": [], "Init. Price": [], "Close": [], "Init. AUD Value": [], "Initial AUD CPI Adj." : [], "Sold AUD Value": [], "Current AUD Value": [], "Dividends Val.": [], "Dividend Fiat": [], "% Returns": [], "% CPI Adj.": []}
-    for key in sorted(stonks):
-        portfolioDf["Ticker"].append(stonks[key].getTicker())
-        portfolioDf["Units"].append(f"{stonks[key].getUnits():.2f}")
-        portfolioDf["Init. Price"].append(f"{stonks[key].getInitPrice():.2f}")
-        portfolioDf["Close"].append(f"{stonks[key].getCurrPrice():.2f}")
-        portfolioDf["Init. AUD Value"].append(f"{stonks[key].getInitValue():.2f}")
-        portfolioDf["Initial AUD CPI Adj."].append(f"{stonks[key].getInitCPIAdjustedValue():.2f}")
-        portfolioDf["Sold AUD Value"].append(f"{stonks[key].sold_value_AUD:.2f}")
-        portfolioDf["Current AUD Value"].append(f"{stonks[key].getCurrValue():.2f}")
-        portfolioDf["Dividends Val."].append(f"{stonks[key].getDividendReturns():.2f}")
-        portfolioDf["Dividend Fiat"].append(f"{stonks[key].getDividendFiatReturns():.2f}")
-        portfolioDf["% Returns"].append(f"{stonks[key].getPercentReturns():.2f}")
-        portfolioDf["% CPI Adj."].append(f"{stonks[key].getPercentReturnsCPIAdj():.2f}")
-        initPortValue["All"] += stonks[key].getInitValue()
-        initPortValue["All CPI Adj."] += stonks[key].getInitCPIAdjustedValue()
-        initPortValue[stonks[key].getAssetType()] += stonks[key].getInitValue()
-        currPortValue["All"] += stonks[key].getCurrValue()
-        currPortValue[stonks[key].getAssetType()] += stonks[key].getCurrValue()
-    percPortChange["All"] = currPortValue["All"] / initPortValue["All"] * 100 - 100
-    percPortChange["All CPI Adj."] = currPortValue["All"] / initPortValue["All CPI Adj."] * 100 - 100
-    percPortChange["AUS Market"] = currPortValue["AUS Market"] / initPortValue["AUS Market"] * 100 - 100
-    percPortChange["Cryptocurrency"] = currPortValue["Cryptocurrency"] / initPortValue["Cryptocurrency"] * 100 - 100
-    percPortChange["US Market"] = currPortValue["US Market"] / initPortValue["US Market"] * 100 - 100
-
-    print(pd.DataFrame(portfolioDf).to_string())
-    print(f"Initial Portfolio Value is: ${initPortValue['All']:.2f}")
-    print(f"Initial Portfolio Value CPI Adj. is: ${initPortValue['All CPI Adj.']:.2f}")
-    print(f"Current Portfolio Value is: ${currPortValue['All']:.2f}")
-    print(f"Percentage Portfolio Performance: {percPortChange['All']:.2f}")
-    print(f"Percentage Portfolio Performance CPI Adj.: {percPortChange['All CPI Adj.']:.2f}")
-    print(f"Realised Profit/Loss: ${realisedProfitLoss:.2f}AUD\n")
-
-    print(f"Initial Aus Market Portfolio Value is: ${initPortValue['AUS Market']:.2f}")
-    print(f"Current Aus Market Portfolio Value is: ${currPortValue['AUS Market']:.2f}")
-    print(f"Aus Market Percentage Portfolio Performance: {percPortChange['AUS Market']:.2f}%\n")
-
-    print(f"Initial Cryptocurrency Portfolio Value is: ${initPortValue['Cryptocurrency']:.2f}")
-    print(f"Current Cryptocurrency Portfolio Value is: ${currPortValue['Cryptocurrency']:.2f}")
-    print(f"Cryptocurrency Percentage Portfolio Performance: {percPortChange['Cryptocurrency']:.2f}%\n")
-
-    print(f"US Market Initial Portfolio Value is: ${initPortValue['US Market']:.2f}")
-    print(f"US Market Current Portfolio Value is: ${currPortValue['US Market']:.2f}")
-    print(f"US Market Percentage Portfolio Performance: {percPortChange['US Market']:.2f}%")
-
-    #Find if .csv already has a value for todays date
-    if csvFound:
-        if portValDf.iloc[len(portValDf) - 1][0] != dt.today().strftime('%d/%m/%Y'):
-            df2 = pd.DataFrame([[dt.today().strftime('%d/%m/%Y'), currPortValue["All"], percPortChange["All"]]],
-                               columns=['Date', 'Value', 'Percentage'])
-            # portValDf = portValDf.concat([portValDf,df2], ignore_index=True)
-            portValDf = pd.concat([portValDf, df2], ignore_index=True)
-        else:
-            portValDf.iloc[len(portValDf) - 1, 1] = str(float("{:.2f}".format(currPortValue["All"])))
-            portValDf.iloc[len(portValDf) - 1, 2] = str(float("{:.2f}".format(percPortChange["All"])))
-    else:
-        portValDf = pd.DataFrame([[dt.today().strftime('%d/%m/%Y'), currPortValue["All"], percPortChange["All"]]], columns=["Date", "Value", "Percentage"])
-        portValDf.to_csv(portValueDir)
-
-    if WRITE_TO_FILE:
-        portValDf.to_csv(portValueDir, index=False)
-
-    for key in stonks:
-        tickerList.append(key)
-        tickerValue.append(stonks[key].getCurrValue())
-
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(32, 9))
-    plt.title("Portfolio Allocation")
-    ax1.pie(tickerValue, labels=tickerList, autopct='%1.1f%%')
-    plt.title("Portfolio Allocation")
-    ax2.pie([currPortValue["AUS Market"], currPortValue["Cryptocurrency"], currPortValue["US Market"]], labels=["Aus Market", "Cryptocurrency", "US Market"], autopct='%1.1f%%')
-#    ax2.title("Portfolio Asset Class Allocation")
+    nameTickers = ["AUD=X"] + ledgerTickers(stocks)
+    with span("price_download"):
+        closes = latestCloses(nameTickers, offline)
+    usdToAUD = closes["AUD=X"]
+    if backfill:
+        with span("backfill"):
+            print(f"Backfilled {backfillHistory(stocks, valueHistory, legacyCsv, nameTickers, offline)} days of portfolio value history")
+    with span("replay"):
+        state = replay_from_checkpoint(stocks, checkpoint_path(portfolioDir))
+    with span("valuation"):
+        holdings, realisedProfitLoss = value_holdings(state, closes, usdToAUD)
+
+    with span("summary"):
+        report, initPortValue, currPortValue, percPortChange = summarisePortfolio(holdings, realisedProfitLoss)
+    print(report)
+    if lotMethod:
+        with span("lots"):
+            print(reportLots(stocks, portfolioDir, lotMethod, lotSelectionPath))
+
+    with span("history"):
+        recordPortfolioValue(valueHistory, legacyCsv, currPortValue["All"], percPortChange["All"])
+        portValDf = valueHistory.range()
+        valueHistory.close()
+
+    tickerList, tickerValue, classLabels, classValues = chartInputs(holdings, currPortValue)
+    if chartsDir:
+        #Headless mode, the summary above is already printed so charts render in the background
+        with span("rendering"):
+            chartWorker = start_chart_worker(chartsDir, tickerList, tickerValue, classLabels, classValues, portValDf, chartFormat)
+        if chartWorker:
+            print(f"Rendering charts to {chartsDir}...")
+        return
+
+    #Only drawing is timed, not the time the windows stay open
+    with span("rendering"):
+        import matplotlib.pyplot as plt
+        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(32, 9))
+        plt.title("Portfolio Allocation")
+        ax1.pie(tickerValue, labels=tickerList, autopct='%1.1f%%')
+        plt.title("Portfolio Allocation")
+        ax2.pie(classValues, labels=classLabels, autopct='%1.1f%%')
+#        ax2.title("Portfolio Asset Class Allocation")
     plt.show()
 
-    plt.plot_date(portValDf['Date'], portValDf['Value'], xdate=True)
-    plt.title("Portfolio Performance over time")
-    plt.ylabel("Portfolio Value ($)")
-    plt.xlabel("Date")
-    plt.tight_layout
+    with span("rendering"):
+        portValDf = downsample_history(portValDf)
+        plt.plot_date(portValDf['Date'], portValDf['Value'], xdate=True)
+        plt.title("Portfolio Performance over time")
+        plt.ylabel("Portfolio Value ($)")
+        plt.xlabel("Date")
+        plt.tight_layout
     plt.show()
 
 if __name__ == '__main__':
@@ -0,0 +1,196 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+
+MAX_WORKERS = 32
+# Sustained requests per second shared by all workers of a Fetcher, after a burst big enough for a
+# whole portfolio refresh to go out in one round
+REQUEST_RATE = 20.0
+REQUEST_BURST = 200
+RETRIES = 3
+BACKOFF_SECONDS = 0.5
+REQUEST_TIMEOUT = 15
+YAHOO_CHART_URL = "https://query1.finance.yahoo.com"
+BAR_FIELDS = ("Open", "High", "Low", "Close", "Volume", "Dividends")
+
+
+class RetryableError(Exception):
+    """A failure worth retrying, e.g. a timeout, HTTP 429 or a 5xx. retry_after is the server's hint in seconds."""
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Thread-safe token bucket: acquire() blocks until a request may be made under rate per second."""
+
+    def __init__(self, rate: float = REQUEST_RATE, capacity: int = REQUEST_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class YFinanceProvider:
+    """Daily bars through yfinance's Ticker.history, one symbol per call."""
+    name = "yfinance"
+
+    def fetch(self, symbol: str, start=None, end=None) -> pd.DataFrame:
+        import yfinance as yf
+
+        try:
+            bars = yf.Ticker(symbol).history(start=start, end=end, period=None if start else "max", interval="1d",
+                                             raise_errors=True)
+        except Exception as e:
+            # yfinance raises its own types for rate limits and dropped connections
+            if any(hint in str(e) for hint in ("Too Many Requests", "Rate limited", "timed out", "Connection")):
+                raise RetryableError(str(e)) from e
+            raise
+        return bars
+
+
+class YahooChartProvider:
+    """
+    Daily bars and dividends straight from Yahoo's chart endpoint. base_url can point at a local
+    stand-in server that answers /v8/finance/chart/<symbol> with the same JSON.
+    """
+    name = "yahoo-chart"
+
+    def __init__(self, base_url: str = YAHOO_CHART_URL, timeout: float = REQUEST_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _session(self):
+        import requests
+
+        # One session per worker thread, requests sessions are not safe to share
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+            self.local.session.headers["User-agent"] = "my-program/1.0"
+        return self.local.session
+
+    def fetch(self, symbol: str, start=None, end=None) -> pd.DataFrame:
+        import requests
+
+        params = {"interval": "1d", "events": "div",
+                  "period1": int(pd.Timestamp(start or "1970-01-01", tz="UTC").timestamp()),
+                  "period2": int(pd.Timestamp(end, tz="UTC").timestamp() if end else
+                                 datetime.now(timezone.utc).timestamp())}
+        try:
+            response = self._session().get(f"{self.base_url}/v8/finance/chart/{symbol}", params=params,
+                                           timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise RetryableError(str(e)) from e
+        if response.status_code == 429 or response.status_code >= 500:
+            retry_after = response.headers.get("Retry-After")
+            raise RetryableError(f"HTTP {response.status_code} for {symbol}",
+                                 float(retry_after) if retry_after and retry_after.isdigit() else None)
+        response.raise_for_status()
+        return chart_bars(response.json())
+
+
+def chart_bars(payload: dict) -> pd.DataFrame:
+    """Parses a chart endpoint response into daily bars at midnight exchange time, like yfinance's history."""
+    result = payload["chart"]["result"][0]
+    timestamps = np.asarray(result.get("timestamp") or [], dtype="int64")
+    tz = result.get("meta", {}).get("exchangeTimezoneName", "UTC")
+    index = pd.to_datetime(timestamps, unit="s", utc=True).tz_convert(tz).normalize()
+    quote = result["indicators"]["quote"][0] if len(timestamps) else {}
+    # Missing values come through as None, which numpy turns into NaN for float arrays
+    bars = pd.DataFrame({field: np.asarray(quote.get(field.lower()) or np.full(len(index), np.nan), dtype=float)
+                         for field in BAR_FIELDS[:-1]}, index=index)
+    bars = bars[~bars.index.duplicated(keep="last")]
+    bars["Dividends"] = 0.0
+    dividends = list(result.get("events", {}).get("dividends", {}).values())
+    if dividends:
+        paid = pd.to_datetime(np.asarray([event["date"] for event in dividends], dtype="int64"), unit="s",
+                              utc=True).tz_convert(tz).normalize()
+        positions = bars.index.get_indexer(paid)
+        amounts = np.zeros(len(bars))
+        # Dividends on a day without a bar are dropped, as yfinance does
+        np.add.at(amounts, positions[positions >= 0],
+                  np.asarray([event["amount"] for event in dividends], dtype=float)[positions >= 0])
+        bars["Dividends"] = amounts
+    bars.index.name = "Date"
+    return bars
+
+
+class Fetcher:
+    """
+    Fetches many symbols at once on a bounded thread pool. Every request takes a token from a
+    shared bucket, and retryable failures back off exponentially (or as long as the server asks).
+    """
+
+    def __init__(self, provider=None, max_workers: int = MAX_WORKERS, rate: float = REQUEST_RATE,
+                 burst: int = REQUEST_BURST, retries: int = RETRIES, backoff: float = BACKOFF_SECONDS):
+        self.provider = provider or YFinanceProvider()
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.errors = {}
+
+    def fetch(self, symbol: str, start=None, end=None) -> pd.DataFrame:
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                return self.provider.fetch(symbol, start, end)
+            except RetryableError as e:
+                if attempt == self.retries:
+                    raise
+                delay = e.retry_after or self.backoff * 2 ** attempt * (1 + random.random())
+                logging.info("%s fetch of %s failed (%s), retrying in %.1fs", self.provider.name, symbol, e, delay)
+                time.sleep(delay)
+
+    def fetch_many(self, symbols, start=None, end=None) -> dict:
+        """
+        Returns {symbol: bars} for the symbols that could be fetched. start may be one date for all
+        or a {symbol: date} mapping. Failures are logged and kept in self.errors.
+        """
+        starts = start if isinstance(start, dict) else dict.fromkeys(symbols, start)
+        self.errors = {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, max(len(symbols), 1))) as executor:
+            futures = {symbol: executor.submit(self.fetch, symbol, starts.get(symbol), end) for symbol in symbols}
+        results = {}
+        for symbol, future in futures.items():
+            try:
+                results[symbol] = future.result()
+            except Exception as e:
+                self.errors[symbol] = e
+                logging.warning("Could not fetch %s from %s: %s", symbol, self.provider.name, e)
+        return results
+
+
+def download_frame(results: dict) -> pd.DataFrame:
+    """Combines fetch_many results into one yf.download style frame, fields x symbols columns on naive dates."""
+    frames = {}
+    for symbol, bars in results.items():
+        if bars is None or bars.empty:
+            continue
+        bars = bars.copy()
+        if bars.index.tz is not None:
+            bars.index = bars.index.tz_localize(None)
+        frames[symbol] = bars[~bars.index.duplicated(keep="last")]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, axis=1).swaplevel(axis=1).sort_index(axis=1)
@@ -0,0 +1,135 @@
+import logging
+import sqlite3
+from datetime import datetime as dt, timedelta
+import pandas as pd
+
+PRICE_STORE_PATH = "prices.sqlite"
+# Bars fetched more recently than this are reused as-is, older ones are fetched again from their date
+STALE_AFTER = timedelta(minutes=15)
+# How far back to go for a ticker the store has never seen
+NEW_TICKER_HISTORY = timedelta(days=5)
+PRICE_FIELDS = ("Open", "High", "Low", "Close", "Volume")
+
+
+class PriceStore:
+    """Daily bars per (ticker, date) in a local SQLite file, refreshed incrementally through market_data."""
+
+    def __init__(self, path: str = PRICE_STORE_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS prices ("
+            "ticker TEXT NOT NULL, date TEXT NOT NULL, open REAL, high REAL, low REAL, close REAL, volume REAL, "
+            "fetched_at TEXT NOT NULL, PRIMARY KEY (ticker, date))")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def _last_fetch(self, tickers) -> pd.DataFrame:
+        placeholders = ",".join("?" * len(tickers))
+        return pd.read_sql_query(
+            f"SELECT ticker, MAX(date) AS last_date, MAX(fetched_at) AS fetched_at FROM prices "
+            f"WHERE ticker IN ({placeholders}) GROUP BY ticker", self.connection, params=list(tickers),
+            index_col="ticker")
+
+    def stale_tickers(self, tickers, now: dt = None) -> dict:
+        """Returns {ticker: first date to fetch, or None for tickers with no stored bars}."""
+        now = now or dt.now()
+        last_fetch = self._last_fetch(tickers)
+        stale = {}
+        for ticker in tickers:
+            if ticker not in last_fetch.index:
+                stale[ticker] = None
+            elif now - dt.fromisoformat(last_fetch.at[ticker, "fetched_at"]) > STALE_AFTER:
+                # Re-fetch the last stored bar as well, it may have been a partial day
+                stale[ticker] = last_fetch.at[ticker, "last_date"]
+        return stale
+
+    def refresh(self, tickers, now: dt = None, fetcher=None) -> int:
+        """Downloads only the missing or stale bars for tickers, all in parallel. Returns the bars written."""
+        from market_data import Fetcher, download_frame
+
+        now = now or dt.now()
+        stale = self.stale_tickers(tickers, now)
+        if not stale:
+            logging.info("Price store is fresh for all %d tickers", len(tickers))
+            return 0
+        # Each ticker is fetched from its own last stored bar, not the oldest one of the batch
+        starts = {ticker: start or (now - NEW_TICKER_HISTORY).strftime("%Y-%m-%d") for ticker, start in stale.items()}
+        dataDf = download_frame((fetcher or Fetcher()).fetch_many(list(stale), starts))
+        logging.debug(pd.DataFrame(dataDf).to_string())
+        return self.write(dataDf, now, list(stale))
+
+    def backfill(self, tickers, start: str, now: dt = None, fetcher=None) -> int:
+        """Downloads daily bars from start for the tickers whose stored history begins later, in parallel."""
+        from market_data import Fetcher, download_frame
+
+        now = now or dt.now()
+        placeholders = ",".join("?" * len(tickers))
+        first_dates = dict(self.connection.execute(
+            f"SELECT ticker, MIN(date) FROM prices WHERE ticker IN ({placeholders}) GROUP BY ticker", list(tickers)))
+        missing = [ticker for ticker in tickers if first_dates.get(ticker) is None or first_dates[ticker] > start]
+        if not missing:
+            return 0
+        logging.info("Backfilling daily bars from %s for %s", start, ", ".join(missing))
+        dataDf = download_frame((fetcher or Fetcher()).fetch_many(missing, start))
+        return self.write(dataDf, now, missing)
+
+    def write(self, dataDf: pd.DataFrame, fetched_at: dt, tickers=None) -> int:
+        """Upserts a yf.download frame (fields x tickers columns) into the store."""
+        if dataDf is None or dataDf.empty:
+            return 0
+        if not isinstance(dataDf.columns, pd.MultiIndex):
+            # Older yfinance releases drop the ticker level when a single ticker is requested
+            dataDf = pd.concat({tickers[0]: dataDf}, axis=1).swaplevel(axis=1)
+        fields = [field for field in PRICE_FIELDS if field in dataDf.columns.get_level_values(0)]
+        bars = dataDf[fields].stack(level=1)
+        bars.index.names = ["date", "ticker"]
+        bars = bars.rename(columns=str.lower).reset_index()
+        bars = bars.dropna(subset=["close"])
+        bars["date"] = pd.to_datetime(bars["date"]).dt.strftime("%Y-%m-%d")
+        bars["fetched_at"] = fetched_at.isoformat()
+        for field in PRICE_FIELDS:
+            if field.lower() not in bars.columns:
+                bars[field.lower()] = None
+        columns = ["ticker", "date", "open", "high", "low", "close", "volume", "fetched_at"]
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO prices ({','.join(columns)}) VALUES ({','.join('?' * len(columns))})",
+            bars[columns].itertuples(index=False, name=None))
+        self.connection.commit()
+        return len(bars)
+
+    def latest_closes(self, tickers) -> pd.Series:
+        """Resolves the last valid close for every ticker in a single query."""
+        placeholders = ",".join("?" * len(tickers))
+        closes = pd.read_sql_query(
+            f"SELECT ticker, close FROM ("
+            f"SELECT ticker, close, ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY date DESC) AS row_number "
+            f"FROM prices WHERE close IS NOT NULL AND ticker IN ({placeholders})) WHERE row_number = 1",
+            self.connection, params=list(tickers), index_col="ticker")["close"]
+        return closes.reindex(list(tickers))
+
+    def history(self, ticker: str, start: str = None) -> pd.Series:
+        """Stored closes of one ticker by date, oldest first."""
+        query = "SELECT date, close FROM prices WHERE ticker = ? AND close IS NOT NULL"
+        params = [ticker]
+        if start is not None:
+            query += " AND date >= ?"
+            params.append(start)
+        closes = pd.read_sql_query(query + " ORDER BY date", self.connection, params=params, index_col="date")["close"]
+        closes.index = pd.to_datetime(closes.index)
+        return closes
+
+    def close_matrix(self, tickers, start: str = None) -> pd.DataFrame:
+        """Stored closes as a dates x tickers frame, NaN where a ticker has no bar for a date."""
+        placeholders = ",".join("?" * len(tickers))
+        query = f"SELECT date, ticker, close FROM prices WHERE close IS NOT NULL AND ticker IN ({placeholders})"
+        params = list(tickers)
+        if start is not None:
+            query += " AND date >= ?"
+            params.append(start)
+        bars = pd.read_sql_query(query, self.connection, params=params)
+        matrix = bars.pivot(index="date", columns="ticker", values="close").reindex(columns=list(tickers))
+        matrix.index = pd.to_datetime(matrix.index)
+        return matrix.sort_index()
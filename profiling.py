@@ -0,0 +1,84 @@
+import asyncio
+import atexit
+import functools
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+# The profiler of this run, None unless a tool was started with --profile
+_active = None
+
+
+class Profiler:
+    """Named timing spans with call counts. Spans may nest, each one records its own wall time."""
+
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.spans = {}
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stats = self.spans.setdefault(name, {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stats["calls"] += 1
+            stats["total_seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+    def report(self) -> dict:
+        spans = {name: {**stats, "mean_seconds": stats["total_seconds"] / stats["calls"]}
+                 for name, stats in sorted(self.spans.items(), key=lambda item: -item[1]["total_seconds"])}
+        return {"tool": self.tool, "started_at": self.started_at.isoformat(timespec="seconds"),
+                "wall_seconds": time.perf_counter() - self.started, "spans": spans}
+
+    def write(self, path: str):
+        report = self.report()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as fp:
+            json.dump(report, fp, indent=2)
+        for name, stats in report["spans"].items():
+            logging.info("Profile %s: %d calls, %.3fs total, %.3fs max", name, stats["calls"],
+                         stats["total_seconds"], stats["max_seconds"])
+
+
+def enable(tool: str, path: str = None) -> Profiler:
+    """
+    Starts profiling this run. With a path the report is written there when the process exits,
+    however it exits, otherwise the caller reads it from the returned Profiler.
+    """
+    global _active
+    _active = Profiler(tool)
+    if path:
+        atexit.register(_active.write, path)
+    return _active
+
+
+def span(name: str):
+    """Times the enclosed block under name when profiling is enabled, otherwise does nothing."""
+    return _active.span(name) if _active is not None else nullcontext()
+
+
+def timed(name: str):
+    """Decorator form of span() for plain and async functions."""
+    def decorate(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timed_coroutine(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+            return timed_coroutine
+
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return timed_function
+    return decorate
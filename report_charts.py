@@ -0,0 +1,125 @@
+import hashlib
+import json
+import logging
+import os
+from multiprocessing import Process
+import numpy as np
+import pandas as pd
+
+# The performance chart never needs more points than a wide monitor has pixels
+MAX_HISTORY_POINTS = 1500
+CHART_FORMATS = ("png", "svg")
+CHARTS_HASH_FILE = "charts.sha256"
+
+
+def downsample_history(history: pd.DataFrame, max_points: int = MAX_HISTORY_POINTS) -> pd.DataFrame:
+    """
+    Thins a long Date/Value history for plotting.
+
+    Each bucket keeps its lowest and highest value so drawdowns and peaks stay visible,
+    and the first and last rows are always kept.
+    """
+    if len(history) <= max_points:
+        return history
+    buckets = np.arange(len(history)) * ((max_points - 2) // 2) // len(history)
+    values = pd.Series(history["Value"].to_numpy(dtype=float))
+    # NaN values (days before a backfilled ticker's first price) are left out, an all-NaN bucket keeps nothing
+    known = values.notna().to_numpy()
+    grouped = values[known].groupby(buckets[known])
+    keep = np.union1d(grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy())
+    keep = np.union1d(keep, [0, len(history) - 1])
+    return history.iloc[keep]
+
+
+def charts_digest(tickerList, tickerValue, classLabels, classValues, history: pd.DataFrame, fmt: str) -> str:
+    payload = json.dumps({
+        "tickers": list(map(str, tickerList)),
+        "values": [round(float(value), 2) for value in tickerValue],
+        "classes": list(classLabels),
+        "classValues": [round(float(value), 2) for value in classValues],
+        "format": fmt,
+    }).encode()
+    digest = hashlib.sha256(payload)
+    digest.update(pd.util.hash_pandas_object(history[["Date", "Value"]], index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _chart_paths(outputDir: str, fmt: str):
+    return os.path.join(outputDir, f"allocation.{fmt}"), os.path.join(outputDir, f"performance.{fmt}")
+
+
+def render_charts(outputDir: str, tickerList, tickerValue, classLabels, classValues, history: pd.DataFrame,
+                  fmt: str = "png"):
+    """Renders the allocation pies and performance chart to files, without a display."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    allocationPath, performancePath = _chart_paths(outputDir, fmt)
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(32, 9))
+    ax1.pie(tickerValue, labels=tickerList, autopct='%1.1f%%')
+    ax1.set_title("Portfolio Allocation")
+    ax2.pie(classValues, labels=classLabels, autopct='%1.1f%%')
+    ax2.set_title("Portfolio Asset Class Allocation")
+    fig.savefig(allocationPath)
+    plt.close(fig)
+
+    fig, ax = plt.subplots()
+    ax.plot(history["Date"], history["Value"], marker="o", linestyle="")
+    ax.set_title("Portfolio Performance over time")
+    ax.set_ylabel("Portfolio Value ($)")
+    ax.set_xlabel("Date")
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    fig.savefig(performancePath)
+    plt.close(fig)
+
+
+def _render_and_record(outputDir, digest, *args):
+    render_charts(outputDir, *args)
+    with open(os.path.join(outputDir, CHARTS_HASH_FILE), "w") as fp:
+        fp.write(digest)
+
+
+def _pending_chart_job(outputDir: str, tickerList, tickerValue, classLabels, classValues, history: pd.DataFrame,
+                       fmt: str):
+    """Returns the arguments for _render_and_record, or None when outputDir already has these charts."""
+    if fmt not in CHART_FORMATS:
+        raise ValueError(f"Chart format must be one of {CHART_FORMATS}, got {fmt}")
+    os.makedirs(outputDir, exist_ok=True)
+    history = downsample_history(history)
+    digest = charts_digest(tickerList, tickerValue, classLabels, classValues, history, fmt)
+    try:
+        with open(os.path.join(outputDir, CHARTS_HASH_FILE)) as fp:
+            unchanged = fp.read() == digest and all(os.path.exists(path) for path in _chart_paths(outputDir, fmt))
+    except FileNotFoundError:
+        unchanged = False
+    if unchanged:
+        logging.info("Charts in %s are up to date, skipping rendering", outputDir)
+        return None
+    return (outputDir, digest, list(tickerList), list(tickerValue), list(classLabels), list(classValues), history,
+            fmt)
+
+
+def update_charts(outputDir: str, tickerList, tickerValue, classLabels, classValues, history: pd.DataFrame,
+                  fmt: str = "png") -> bool:
+    """Renders the charts in this process if their inputs changed. Returns whether anything was rendered."""
+    job = _pending_chart_job(outputDir, tickerList, tickerValue, classLabels, classValues, history, fmt)
+    if job is None:
+        return False
+    _render_and_record(*job)
+    return True
+
+
+def start_chart_worker(outputDir: str, tickerList, tickerValue, classLabels, classValues, history: pd.DataFrame,
+                       fmt: str = "png"):
+    """
+    Renders the charts in a background process and returns it, or None when the charts in
+    outputDir were already rendered from the same inputs.
+    """
+    job = _pending_chart_job(outputDir, tickerList, tickerValue, classLabels, classValues, history, fmt)
+    if job is None:
+        return None
+    worker = Process(target=_render_and_record, args=job)
+    worker.start()
+    return worker
@@ -13,6 +13,8 @@ from yaml import dump, safe_load
 from dotenv import load_dotenv
 from os import getenv
 
+from profiling import enable, span, timed
+
 # Constants
 STAKE_PROGRAM_ID = Pubkey.from_string(
     "Stake11111111111111111111111111111111111111")
@@ -39,6 +41,7 @@ def format_timestamp(unix_timestamp: Optional[int]) -> str:
         return "Invalid Timestamp"
 
 
+@timed("price.sol_aud_history")
 async def get_historical_sol_aud_rate(date_str: str) -> Optional[float]:
     """Fetches historical SOL to AUD rate for a specific date (dd-mm-yyyy)."""
     api_url = COINGECKO_HISTORY_API_URL.format(date=date_str)
@@ -88,7 +91,8 @@ async def get_staking_rewards(wallet_address: str, rpc_url: str, epochs_to_check
 
     async with AsyncClient(rpc_url, commitment=Confirmed) as client:
         try:
-            is_healthy = await client.is_connected()
+            with span("rpc.is_connected"):
+                is_healthy = await client.is_connected()
             if not is_healthy:
                 print("Error: Failed to connect to the Solana RPC endpoint.")
                 return
@@ -101,12 +105,13 @@ async def get_staking_rewards(wallet_address: str, rpc_url: str, epochs_to_check
                            bytes=str(user_pubkey)),
             ]
 
-            response = await client.get_program_accounts(
-                STAKE_PROGRAM_ID,
-                commitment=Confirmed,
-                encoding="base64",
-                filters=filters
-            )
+            with span("rpc.get_program_accounts"):
+                response = await client.get_program_accounts(
+                    STAKE_PROGRAM_ID,
+                    commitment=Confirmed,
+                    encoding="base64",
+                    filters=filters
+                )
 
             stake_accounts_info = response.value
             if not stake_accounts_info:
@@ -121,7 +126,8 @@ async def get_staking_rewards(wallet_address: str, rpc_url: str, epochs_to_check
                 print(f"- {pk}")
 
             print("\nFetching current epoch information...")
-            epoch_info_res = await client.get_epoch_info(commitment=Confirmed)
+            with span("rpc.get_epoch_info"):
+                epoch_info_res = await client.get_epoch_info(commitment=Confirmed)
             current_epoch = epoch_info_res.value.epoch
             print(f"Current epoch: {current_epoch}")
 
@@ -138,11 +144,12 @@ async def get_staking_rewards(wallet_address: str, rpc_url: str, epochs_to_check
                 if epoch_num in staking_rewards.keys():
                     continue
                 try:
-                    rewards_res = await client.get_inflation_reward(
-                        pubkeys=stake_account_pubkeys,
-                        epoch=epoch_num,  # type: ignore
-                        commitment=Confirmed
-                    )
+                    with span("rpc.get_inflation_reward"):
+                        rewards_res = await client.get_inflation_reward(
+                            pubkeys=stake_account_pubkeys,
+                            epoch=epoch_num,  # type: ignore
+                            commitment=Confirmed
+                        )
 
                     epoch_rewards_lamports = 0
                     rewards_by_epoch[epoch_num] = {}
@@ -157,7 +164,8 @@ async def get_staking_rewards(wallet_address: str, rpc_url: str, epochs_to_check
 
                             timestamp_unix: Optional[int] = None
                             try:
-                                block_time_res = await client.get_block_time(effective_slot)
+                                with span("block_time"):
+                                    block_time_res = await client.get_block_time(effective_slot)
                                 if block_time_res.value is not None:
                                     timestamp_unix = block_time_res.value
                             except Exception as e:
@@ -175,7 +183,8 @@ async def get_staking_rewards(wallet_address: str, rpc_url: str, epochs_to_check
                                     rate = await get_historical_sol_aud_rate(date_key)
                                     date_to_aud_rate_cache[date_key] = rate
                                     # Add delay *only* when a new API call is made
-                                    await asyncio.sleep(COINGECKO_API_DELAY)
+                                    with span("price.rate_limit_delay"):
+                                        await asyncio.sleep(COINGECKO_API_DELAY)
                                 else:
                                     rate = date_to_aud_rate_cache[date_key]
 
@@ -272,7 +281,7 @@ async def get_staking_rewards(wallet_address: str, rpc_url: str, epochs_to_check
     print("Ensure you have the 'solana' and 'requests' Python libraries installed (`pip install solana requests`).")
 
 
-async def main():
+async def main(argv=None):
     parser = argparse.ArgumentParser(
         description="Retrieve Solana native staking rewards for a wallet address, with historical AUD conversion.")
     parser.add_argument("wallet_address", type=str,
@@ -289,8 +298,15 @@ async def main():
         default=308,  # Further reduced default due to historical API calls
         help="Number of recent epochs to check for rewards. (Defaults to 2)"
     )
+    parser.add_argument(
+        "--profile",
+        metavar="JSON",
+        help="Write named timing spans (RPC, block time and price calls) for this run to a JSON file."
+    )
     load_dotenv()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.profile:
+        enable("solana_staking_reward_tracker", args.profile)
 
     if args.epochs <= 0:
         print("Error: Number of epochs to check must be positive.")
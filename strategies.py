@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+
+def red_close(bars: pd.DataFrame) -> np.ndarray:
+    """Days that closed below their open."""
+    return np.asarray(bars["Close"]) < np.asarray(bars["Open"])
+
+
+def red_low(bars: pd.DataFrame) -> np.ndarray:
+    """Days that traded below their open at some point."""
+    return np.asarray(bars["Low"]) < np.asarray(bars["Open"])
+
+
+# Vectorized signals, each a function of the bars returning one bool per bar. The bars may be a frame or a
+# mapping of columns to paths x bars arrays, see backtest_monte_carlo
+SIGNALS = {"red close": red_close, "red low": red_low}
+# Per strategy: the price column bought at, the signal to wait for (None buys on the scheduled day) and
+# how many trading days from the scheduled day to wait for it before buying on the last one anyway
+# (None waits for as long as it takes)
+STRATEGIES = {
+    "Blind": ("Close", None, None),
+    "Red Day": ("Close", "red close", None),
+    "Red Low": ("Low", "red low", None),
+    "Red Day-5": ("Close", "red close", 5),
+    "Red Day-10": ("Close", "red close", 10),
+}
+
+
+def next_signal_index(signal: np.ndarray) -> np.ndarray:
+    """
+    For every bar, the index of the first bar on or after it with the signal set, len(signal)
+    where there is none, plus a trailing len(signal) so a past-the-end day maps to none too.
+    One reverse running minimum over the signal days, along the last axis for a batch of paths.
+    """
+    bars = signal.shape[-1]
+    positions = np.where(signal, np.arange(bars), bars)
+    next_signal = np.minimum.accumulate(positions[..., ::-1], axis=-1)[..., ::-1]
+    return np.concatenate([next_signal, np.full(next_signal.shape[:-1] + (1,), bars)], axis=-1)
+
+
+def buy_indices(dates: np.ndarray, schedule: np.ndarray, next_signal: np.ndarray = None,
+                window: int = None) -> np.ndarray:
+    """
+    The bar each scheduled buy lands on: the first trading day on or after it, then with a signal
+    the first day from there the signal is set, within window trading days if given. -1 where the
+    history ends first. One row per path for a batch of next-signal arrays.
+    """
+    indices = np.searchsorted(dates, schedule, side="left")
+    if next_signal is not None:
+        signalled = next_signal[..., indices]
+        if window is not None:
+            # No signal in the window, buy on its last day
+            signalled = np.where(signalled - indices < window, signalled, indices + window - 1)
+        indices = signalled
+    return np.where(indices < len(dates), indices, -1)
+
+
+def strategy_buys(bars: pd.DataFrame, dates: np.ndarray, schedule: np.ndarray, strategy: str):
+    """The bar indices strategy buys at for schedule (-1 where it never gets to), and the prices paid."""
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy {strategy}")
+    price_column, signal_name, window = STRATEGIES[strategy]
+    next_signal = None if signal_name is None else next_signal_index(SIGNALS[signal_name](bars))
+    buys = buy_indices(dates, schedule, next_signal, window)
+    return buys, np.asarray(bars[price_column], dtype=float)
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from ledger_replay import replay_rows
+
+# Running per-ticker fields carried forward from the last ledger row on or before each day
+DAILY_FIELDS = ("units", "init_value_running", "fiat_since_recalc_running")
+
+
+def holdings_matrices(stocks: pd.DataFrame, calendar: pd.DatetimeIndex) -> dict:
+    """Replays the ledger once and returns a dates x tickers matrix of each DAILY_FIELDS field over calendar."""
+    rows = replay_rows(stocks)
+    rows["Date"] = pd.to_datetime(rows["Date"]).dt.normalize()
+    # The last row of a day holds that day's closing position
+    days = rows.drop_duplicates(["Date", "Ticker"], keep="last")
+    matrices = {}
+    for field in DAILY_FIELDS:
+        matrix = days.pivot(index="Date", columns="Ticker", values=field)
+        matrices[field] = matrix.reindex(calendar.union(matrix.index)).ffill().reindex(calendar).fillna(0.0)
+    return matrices
+
+
+def ledger_prices(stocks: pd.DataFrame) -> pd.DataFrame:
+    """The last traded price of each ticker per day, a stand-in where the price store has no close."""
+    trades = pd.DataFrame({"Date": pd.to_datetime(stocks["Date"]).dt.normalize(), "Ticker": stocks["Ticker"],
+                           "Price": pd.to_numeric(stocks["Price"], errors="coerce")})
+    trades = trades[stocks["Action"].isin(("BUY", "SELL")).to_numpy()].dropna(subset=["Price"])
+    return trades.drop_duplicates(["Date", "Ticker"], keep="last").pivot(index="Date", columns="Ticker",
+                                                                          values="Price")
+
+
+def daily_value_curve(stocks: pd.DataFrame, closes: pd.DataFrame, usd_to_aud: pd.Series, start=None,
+                      end=None) -> pd.DataFrame:
+    """
+    Reconstructs the daily Date/Value/Percentage history of a ledger in one vectorized pass.
+
+    Holdings, closes and the USD/AUD rate are each aligned to a daily calendar and carried
+    forward over days without a trade or a bar, then valued the same way value_holdings() values
+    the latest day: units at the close plus the retained fiat dividends, in AUD, against the
+    initial value held on that day.
+    """
+    dates = pd.to_datetime(stocks["Date"])
+    start = pd.Timestamp(start if start is not None else dates.min()).normalize()
+    end = pd.Timestamp(end if end is not None else pd.Timestamp.today()).normalize()
+    calendar = pd.date_range(start, end, freq="D")
+    matrices = holdings_matrices(stocks, calendar)
+    tickers = matrices["units"].columns
+
+    # Stored closes win, the ledger's own trade prices fill the days before the stored history begins
+    prices = closes.reindex(columns=tickers).combine_first(ledger_prices(stocks).reindex(columns=tickers))
+    prices = prices.reindex(calendar.union(prices.index)).ffill().reindex(calendar)
+    rate = usd_to_aud.reindex(calendar.union(usd_to_aud.index)).ffill().bfill().reindex(calendar).to_numpy()
+    aus = tickers.astype(str).str.endswith("AX")
+    fx = np.where(aus[np.newaxis, :], 1.0, rate[:, np.newaxis])
+
+    units = matrices["units"].to_numpy()
+    # Tickers no longer held contribute nothing even on days without a price
+    market = np.where(units > 0, units * prices.to_numpy(), 0.0)
+    value = ((market + matrices["fiat_since_recalc_running"].to_numpy()) * fx).sum(axis=1)
+    init_value = matrices["init_value_running"].to_numpy().sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percentage = value / init_value * 100 - 100
+    return pd.DataFrame({"Date": calendar, "Value": value, "Percentage": percentage})
@@ -0,0 +1,109 @@
+import logging
+import os
+import sqlite3
+from datetime import date
+import pandas as pd
+
+CSV_DATE_FORMAT = "%d/%m/%Y"
+
+
+def history_store_path(portValueDir: str) -> str:
+    """A .csv history passed with -o gets a SQLite store next to it, a .sqlite path is used as-is."""
+    root, extension = os.path.splitext(portValueDir)
+    return portValueDir if extension in (".sqlite", ".db") else root + ".sqlite"
+
+
+class ValueHistory:
+    """Daily portfolio value history in SQLite, keyed by ISO date so upserts and range reads use the index."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS history (date TEXT PRIMARY KEY, value REAL, percentage REAL)")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def upsert(self, day: date, value: float, percentage: float):
+        """Writes the row for day, replacing it if it already exists."""
+        self.connection.execute("INSERT OR REPLACE INTO history (date, value, percentage) VALUES (?, ?, ?)",
+                                (day.strftime("%Y-%m-%d"), float(value), float(percentage)))
+        self.connection.commit()
+
+    def upsert_many(self, rows: pd.DataFrame):
+        """Bulk upsert of a Date/Value/Percentage frame, Date as datetimes."""
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO history (date, value, percentage) VALUES (?, ?, ?)",
+            zip(pd.to_datetime(rows["Date"]).dt.strftime("%Y-%m-%d"), rows["Value"].astype(float),
+                rows["Percentage"].astype(float)))
+        self.connection.commit()
+
+    def range(self, start: date = None, end: date = None) -> pd.DataFrame:
+        """Returns the Date/Value/Percentage rows between start and end inclusive, oldest first."""
+        query = "SELECT date AS Date, value AS Value, percentage AS Percentage FROM history"
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("date >= ?")
+            params.append(start.strftime("%Y-%m-%d"))
+        if end is not None:
+            conditions.append("date <= ?")
+            params.append(end.strftime("%Y-%m-%d"))
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        history = pd.read_sql_query(query + " ORDER BY date", self.connection, params=params)
+        history["Date"] = pd.to_datetime(history["Date"])
+        return history
+
+    def import_csv(self, csvPath: str) -> int:
+        """One-off import of a legacy Date,Value,Percentage csv with dd/mm/yyyy dates."""
+        legacy = pd.read_csv(csvPath)
+        legacy = legacy.rename(columns={legacy.columns[0]: "Date", legacy.columns[1]: "Value",
+                                        legacy.columns[2]: "Percentage"})
+        legacy["Date"] = pd.to_datetime(legacy["Date"], format=CSV_DATE_FORMAT)
+        self.upsert_many(legacy)
+        logging.info("Imported %d rows from %s into %s", len(legacy), csvPath, self.path)
+        return len(legacy)
+
+
+def append_csv_row(csvPath: str, day: date, value: float, percentage: float):
+    """
+    Keeps a legacy csv history current without reading or rewriting it.
+
+    Only the last line is inspected: it is overwritten in place when it is already for day,
+    otherwise the new row is appended.
+    """
+    line = f"{day.strftime(CSV_DATE_FORMAT)},{value:.2f},{percentage:.2f}\n".encode()
+    if not os.path.exists(csvPath) or os.path.getsize(csvPath) == 0:
+        with open(csvPath, "wb") as fp:
+            fp.write(b"Date,Value,Percentage\n" + line)
+        return
+    with open(csvPath, "rb+") as fp:
+        fp.seek(0, os.SEEK_END)
+        size = fp.tell()
+        # Walk back over the trailing newline(s) and then to the start of the last line
+        tail_start = max(0, size - 4096)
+        fp.seek(tail_start)
+        tail = fp.read()
+        stripped = tail.rstrip(b"\r\n")
+        last_line_start = tail_start + stripped.rfind(b"\n") + 1
+        last_line = stripped[stripped.rfind(b"\n") + 1:].decode()
+        if last_line.split(",")[0] == day.strftime(CSV_DATE_FORMAT):
+            fp.seek(last_line_start)
+            fp.truncate()
+        else:
+            fp.seek(tail_start + len(stripped))
+            fp.truncate()
+            fp.write(b"\n")
+        fp.write(line)
+
+
+def write_csv(csvPath: str, history: pd.DataFrame):
+    """Rewrites a legacy csv history in full from a Date/Value/Percentage frame, e.g. after a backfill."""
+    legacy = history[["Date", "Value", "Percentage"]].copy()
+    legacy["Date"] = pd.to_datetime(legacy["Date"]).dt.strftime(CSV_DATE_FORMAT)
+    legacy.to_csv(csvPath, index=False, float_format="%.2f")